@@ -0,0 +1,1212 @@
+# Copyright 2014 Sandra Giuliani
+# benchmark.py
+
+# Benchmarks for drug_repo.py, on synthetic input files
+# run all benchmarks (>python benchmark.py) or only some of them
+# (eg >python benchmark.py step1)
+# input files are written to a temporary directory, removed at the end
+
+# See README.md for more info
+
+
+
+
+############################################################################
+### IMPORT PYTHON MODULES
+############################################################################
+
+import sys, os, re, shutil, tempfile, random, multiprocessing
+
+# peak memory of the loaders, each in its own python process
+import subprocess, resource
+
+# stand-in http server
+import time, threading, BaseHTTPServer, SocketServer
+
+# timer
+from timeit import default_timer as timer
+
+# import drug_repo (and config.py with it)
+import drug_repo as d
+c = d.c
+############################################################################
+
+
+
+
+############################################################################
+### HELPERS
+############################################################################
+# time a function call, return (seconds, returned object)
+
+def time_call(function_name, *args):
+  start = timer()
+  returned = function_name(*args)
+  return (timer() - start), returned
+
+
+# print a row of the benchmark table
+
+def report(name, size, seconds):
+  print('%-28s %10d %10.3f s' % (name, size, seconds))
+############################################################################
+
+
+
+
+############################################################################
+### STEP 1 SYNTHETIC INPUTS
+############################################################################
+# write synthetic chembl drugs, drug targets, chembl/uniprot mapping and
+# drugbank files with n drugs, in directory tmp_dir
+
+def write_step1_inputs(tmp_dir, n):
+  rand = random.Random(n)
+  n_targets = max(n / 5, 1)
+
+  # chembl drugs
+  with open(os.path.join(tmp_dir, 'chembl_drugs.txt'), 'w') as f:
+    f.write('CHEMBL_ID\tSYNONYMS\tDEVELOPMENT_PHASE\tDRUG_TYPE\t' +
+            'CANONICAL_SMILES\n')
+    for i in range(n):
+      f.write('CHEMBL%d\tdrug %d\t%s\t%s\tCCO\n' % (i, i,
+              rand.choice(['1', '2', '3', '4', '']),
+              rand.choice(c.chembl_mol_type + ['Protein'])))
+
+  # chembl drug targets, three targets per drug
+  with open(os.path.join(tmp_dir, 'chembl_drugtargets.txt'), 'w') as f:
+    f.write('MOLECULE_CHEMBL_ID\tMOLECULE_NAME\tTARGET_CHEMBL_ID\n')
+    for i in range(n):
+      for j in range(3):
+        f.write('CHEMBL%d\tdrug %d\tCHEMBLT%d\n' %
+                (i, i, rand.randint(0, n_targets)))
+
+  # chembl/uniprot mapping
+  with open(os.path.join(tmp_dir, 'chembl_uniprot_mapping.txt'), 'w') as f:
+    f.write('# synthetic target list\n')
+    for t in range(n_targets + 1):
+      f.write('P%05d\tCHEMBLT%d\n' % (t, t))
+
+  # drugbank, each uniprot with a few drugs
+  with open(os.path.join(tmp_dir, 'drugbank.csv'), 'w') as f:
+    f.write('ID,Name,UniProt ID,Drug IDs\n')
+    for t in range(n):
+      drugs = ['DB%05d' % rand.randint(0, n) for k in range(4)]
+      f.write('%d,target %d,P%05d,%s\n' % (t, t, t, '; '.join(drugs)))
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_STEP1
+############################################################################
+# step 1 runtime (process_chembl and process_drugbank) against input size
+
+def bench_step1():
+  print('--- step 1 runtime against number of drugs ---')
+  saved = c.chembl_targets, c.chembl_uniprot
+  for n in [1000, 2000, 4000, 8000, 16000, 32000]:
+    tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+    try:
+      write_step1_inputs(tmp_dir, n)
+      c.chembl_targets = os.path.join(tmp_dir, 'chembl_drugtargets.txt')
+      c.chembl_uniprot = os.path.join(tmp_dir, 'chembl_uniprot_mapping.txt')
+
+      seconds = time_call(d.process_chembl,
+                          os.path.join(tmp_dir, 'chembl_drugs.txt'))[0]
+      report('process_chembl', n, seconds)
+
+      seconds = time_call(d.process_drugbank,
+                          os.path.join(tmp_dir, 'drugbank.csv'))[0]
+      report('process_drugbank', n, seconds)
+    finally:
+      shutil.rmtree(tmp_dir)
+      c.chembl_targets, c.chembl_uniprot = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_COMPRESSED
+############################################################################
+# read throughput of open_input on a plain file and on its compressed
+# versions (gz, bz2, and xz if lzma is available)
+
+def bench_compressed():
+  print('--- read throughput, plain against compressed ---')
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    # lig_pairs.lst-like file, 500k lines
+    rand = random.Random(0)
+    plain = os.path.join(tmp_dir, 'lig_pairs.lst')
+    with open(plain, 'w') as f:
+      for i in range(500000):
+        f.write('%04x :  %s; %s;\n' % (i, rand.choice(['SO4', 'HEM', 'MG']),
+                                        rand.choice(['NAD', 'ATP', 'GOL'])))
+    size_mb = os.path.getsize(plain) / 1048576.0
+
+    file_list = [plain]
+    with open(plain, 'rb') as f:
+      data = f.read()
+    with d.gzip.open(plain + '.gz', 'wb') as f:
+      f.write(data)
+    file_list.append(plain + '.gz')
+    with d.bz2.BZ2File(plain + '.bz2', 'w') as f:
+      f.write(data)
+    file_list.append(plain + '.bz2')
+    if d.lzma is not None:
+      with d.lzma.open(plain + '.xz', 'wb') as f:
+        f.write(data)
+      file_list.append(plain + '.xz')
+
+    for file_name in file_list:
+      start = timer()
+      input_handle = d.open_input(file_name)
+      for line in input_handle:
+        pass
+      input_handle.close()
+      seconds = timer() - start
+      print('%-28s %8.1f MB on disk %8.1f MB/s' % (
+            os.path.basename(file_name),
+            os.path.getsize(file_name) / 1048576.0, size_mb / seconds))
+  finally:
+    shutil.rmtree(tmp_dir)
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_PARALLEL
+############################################################################
+# steps 5-6 reference files (lig_pairs.lst, pointless_het.csv,
+# uniprot_pdb.csv and Components-smiles-oe.smi), loaded one after the other
+# with run_or_pickle against parallel_load ahead of the same run_or_pickle
+# calls, as in main(); then the time each step spends reading its pickles
+# parallel_load only starts a pool with more than one processor
+# pickles are written to a temporary directory, removed at the end
+
+# the parallel_load jobs of steps 5-6
+
+def reference_jobs():
+  return [('5_pdb_lig_dic', d.lst_dic, (os.path.abspath(c.pdb_lig),)),
+          ('5_pointless_het', d.csv_to_lst,
+           (os.path.abspath(c.pointless_het),)),
+          ('6_uniprot_pdb_dic', d.csv_to_dic,
+           (os.path.abspath(c.uniprot_pdb),)),
+          ('6_cc_smiles', d.smi_to_dic, (os.path.abspath(c.cc_smi), 1, 0))]
+
+def run_or_pickle_jobs(job_list):
+  for pickle_name, function_name, args in job_list:
+    d.run_or_pickle(pickle_name, function_name, *args)
+
+def parallel_jobs(job_list):
+  d.parallel_load(job_list)
+  run_or_pickle_jobs(job_list)
+
+def remove_pickles(job_list):
+  for pickle_name, function_name, args in job_list:
+    if os.path.isfile(pickle_name + '.p'):
+      os.remove(pickle_name + '.p')
+
+def bench_parallel():
+  print('--- steps 5-6 reference files, serial against parallel ---')
+  print('%d processors, %d load workers' % (multiprocessing.cpu_count(),
+                                            c.load_workers))
+  job_list = reference_jobs()
+  use_bundle = c.use_bundle
+  c.use_bundle = False
+  home_dir = os.getcwd()
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    os.chdir(tmp_dir)
+    report('serial', len(job_list),
+           time_call(run_or_pickle_jobs, job_list)[0])
+
+    remove_pickles(job_list)
+    report('parallel', len(job_list),
+           time_call(parallel_jobs, job_list)[0])
+
+    # pickles written by the workers, read by each step
+    remove_pickles(job_list)
+    report('parallel_load', len(job_list),
+           time_call(d.parallel_load, job_list)[0])
+    report('step 5 reads', 2, time_call(run_or_pickle_jobs,
+                                        job_list[:2])[0])
+    report('step 6 reads', 2, time_call(run_or_pickle_jobs,
+                                        job_list[2:])[0])
+  finally:
+    os.chdir(home_dir)
+    shutil.rmtree(tmp_dir)
+    c.use_bundle = use_bundle
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_BUNDLE
+############################################################################
+# steps 5-6 reference files loaded the way main() loads them (no pickles
+# yet), through parallel_load and through run_or_pickle, parsing the text
+# files against reading the compiled input bundle
+# bundle and pickles are written to a temporary directory, removed at the
+# end
+
+def bench_bundle():
+  print('--- steps 5-6 reference files, text against bundle ---')
+  job_list = reference_jobs()
+  saved = (c.use_bundle, c.bundle_dir, c.pdb_lig, c.pointless_het,
+           c.uniprot_pdb, c.cc_smi)
+  home_dir = os.getcwd()
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    # bundle entries are found by the loader arguments, the same absolute
+    # paths as the jobs; the other input files are not in tmp_dir, and
+    # compile_inputs skips them
+    c.pdb_lig = os.path.abspath(c.pdb_lig)
+    c.pointless_het = os.path.abspath(c.pointless_het)
+    c.uniprot_pdb = os.path.abspath(c.uniprot_pdb)
+    c.cc_smi = os.path.abspath(c.cc_smi)
+    c.bundle_dir = os.path.join(tmp_dir, 'bundle')
+    os.chdir(tmp_dir)
+    d.compile_inputs()
+
+    for use_bundle in [False, True]:
+      c.use_bundle = use_bundle
+      if use_bundle:
+        name = 'bundle'
+      else:
+        name = 'text'
+      for load_name, load_jobs in [('parallel', parallel_jobs),
+                                   ('serial', run_or_pickle_jobs)]:
+        remove_pickles(job_list)
+        report(load_name + ', ' + name, len(job_list),
+               time_call(load_jobs, job_list)[0])
+  finally:
+    os.chdir(home_dir)
+    shutil.rmtree(tmp_dir)
+    d.bundle_manifest_cache.clear()
+    (c.use_bundle, c.bundle_dir, c.pdb_lig, c.pointless_het, c.uniprot_pdb,
+     c.cc_smi) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_MEMORY
+############################################################################
+# peak memory (maximum resident set size) of each loader, streaming its
+# lines with LineSource against reading the whole file first (the old
+# readlines approach)
+# each loader runs in a new python process (>python benchmark.py
+# memory-child name mode), so that nothing this process holds counts, and
+# the peak of a child that runs nothing is taken away
+
+class ReadlinesSource(d.LineSource):
+  # all lines are read before the first one is processed
+  def __init__(self, text_file, has_header=False):
+    super(ReadlinesSource, self).__init__(text_file, has_header)
+    self.lines = self.input_handle.readlines()
+
+  def __iter__(self):
+    for line in self.lines:
+      yield line
+
+
+# (name, function, arguments) of the loaders measured
+
+def memory_jobs():
+  return [('lst_dic', d.lst_dic, (c.pdb_lig,)),
+          ('csv_to_dic', d.csv_to_dic, (c.uniprot_pdb,)),
+          ('smi_to_dic', d.smi_to_dic, (c.cc_smi, 1, 0)),
+          ('swap_dic', d.swap_dic, (c.chembl_uniprot, 'many')),
+          ('process_drugbank', d.process_drugbank, (c.drugbank_input,)),
+          ('txt_to_columns', d.txt_to_columns,
+           (c.chembl_input, '\t', d.chembl_drug_columns))]
+
+
+# in the child: run the loader name ('none' for nothing) with mode
+# 'readlines' or 'streaming', print the peak rss in kB
+# ru_maxrss is kept across fork and exec, so a child of a big process
+# would report the parent's peak; VmHWM (linux) starts again at exec
+
+def memory_child(name, mode):
+  c.use_bundle = False
+  if mode == 'readlines':
+    d.LineSource = ReadlinesSource
+  for job_name, function_name, args in memory_jobs():
+    if job_name == name:
+      function_name(*args)
+  if os.path.isfile('/proc/self/status'):
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          print(line.split()[1])
+          return
+  print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+# peak rss in MB of a child process running memory_child(name, mode)
+
+def child_peak_rss(name, mode):
+  # this file, not its .pyc when imported
+  script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+  output = subprocess.check_output([sys.executable, script,
+                                    'memory-child', name, mode])
+  # VmHWM, and ru_maxrss on linux, are in kB
+  return int(output.split()[-1]) / 1024.0
+
+
+def bench_memory():
+  print('--- peak rss of each loader, readlines against streaming ---')
+  base = child_peak_rss('none', 'streaming')
+  print('%-28s %12s %12s' % ('', 'readlines', 'streaming'))
+  for name, function_name, args in memory_jobs():
+    old_peak = child_peak_rss(name, 'readlines') - base
+    new_peak = child_peak_rss(name, 'streaming') - base
+    print('%-28s %9.1f MB %9.1f MB' % (name, old_peak, new_peak))
+############################################################################
+
+
+
+
+############################################################################
+### ARCHINDEX STAND-IN
+############################################################################
+# write a shell script that answers like archindex (a fixed architecture for
+# any uniprot id, and one uniprot id per species for any architecture, or
+# for the species given with -s, with the species in column 3), in tmp_dir
+# return its path
+
+stand_in = """#!/bin/sh
+# stand-in for archindex
+case "$*" in
+  *-cath*) arch="1.10.10.10p_2.40.50.140";;
+  *) arch="PF00001.PF00002";;
+esac
+species="SCHMA SCHHA SCHJA TRYB2"
+case "$*" in
+  *-s\ *) species=`echo "$*" | sed 's/.*-s \\([A-Z0-9]*\\).*/\\1/'`;;
+esac
+if [ "$1" = "-u" ]; then
+  echo ":PARENT"
+  printf '%s\t1\t%s\t1\n' "$2" "$arch"
+else
+  echo ":A"
+  echo "header"
+  for taxa in $species; do
+    printf 'Q%s_%s\t1\t%s\t%s\n' "$taxa" "$2" "$arch" "$taxa"
+  done
+  echo ":END"
+fi
+"""
+
+def write_stand_in(tmp_dir):
+  script = os.path.join(tmp_dir, 'archindex')
+  with open(script, 'w') as f:
+    f.write(stand_in)
+  os.chmod(script, 0o755)
+  return script
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_ARCHINDEX
+############################################################################
+# archindex calls per second in uniprot_to_arch, with the stand-in script,
+# one query per batch against batches of c.archindex_batch, run one after
+# the other or c.archindex_workers at a time, and all from the cache
+
+def bench_archindex():
+  print('--- archindex calls per second, stand-in script ---')
+  uniprot_list = ['P%05d' % i for i in range(500)]
+  archindex_path = c.archindex_path
+  archindex_batch = c.archindex_batch
+  archindex_workers = c.archindex_workers
+  archindex_cache = c.archindex_cache
+  home_dir = os.getcwd()
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    os.chdir(tmp_dir)
+    c.archindex_path = write_stand_in(tmp_dir)
+    c.archindex_cache = ''
+    for batch, workers in [(1, 1), (archindex_batch, 1),
+                           (archindex_batch, archindex_workers)]:
+      c.archindex_batch = batch
+      c.archindex_workers = workers
+      seconds = time_call(d.uniprot_to_arch, uniprot_list, 'cath')[0]
+      print('%-28s %10d %10.1f calls/s' % (
+            'batch of %d, %d workers' % (batch, workers),
+            len(uniprot_list), len(uniprot_list) / seconds))
+
+    # fill the cache, then time a run that only reads it
+    c.archindex_cache = 'dr_archindex_cache.db'
+    d.uniprot_to_arch(uniprot_list, 'cath')
+    seconds = time_call(d.uniprot_to_arch, uniprot_list, 'cath')[0]
+    print('%-28s %10d %10.1f calls/s' % ('cached', len(uniprot_list),
+          len(uniprot_list) / seconds))
+  finally:
+    os.chdir(home_dir)
+    shutil.rmtree(tmp_dir)
+    c.archindex_path = archindex_path
+    c.archindex_batch = archindex_batch
+    c.archindex_workers = archindex_workers
+    c.archindex_cache = archindex_cache
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_TAXA
+############################################################################
+# step 3 (arch_to_uniprot) runtime against the number of taxa, with the
+# stand-in script, one query per taxa code against one query for all taxa
+# both give the same dictionary
+
+def bench_taxa():
+  print('--- arch_to_uniprot runtime against number of taxa ---')
+  arch_list = ['1.10.10.%d' % i for i in range(200)]
+  saved = (c.archindex_path, c.archindex_cache, c.taxa,
+           c.archindex_all_taxa)
+  home_dir = os.getcwd()
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    os.chdir(tmp_dir)
+    c.archindex_path = write_stand_in(tmp_dir)
+    c.archindex_cache = ''
+    taxa = ['SCHMA', 'SCHHA', 'SCHJA', 'TRYB2']
+    # {number of taxa: dictionary of the per taxa queries}
+    per_taxa = {}
+    for all_taxa in [False, True]:
+      c.archindex_all_taxa = all_taxa
+      for n in range(1, len(taxa) + 1):
+        c.taxa = taxa[:n]
+        seconds, uniprot_dic = time_call(d.arch_to_uniprot, arch_list,
+                                         'cath')
+        report('%d taxa, %s' % (n, ['per taxa', 'all taxa'][all_taxa]),
+               len(arch_list), seconds)
+        sorted_dic = dict((arch_id, sorted(uniprot_list))
+                          for arch_id, uniprot_list in uniprot_dic.items())
+        if not all_taxa:
+          check(len(sorted_dic) == len(arch_list) and
+                all(len(uniprot_list) == n
+                    for uniprot_list in sorted_dic.values()),
+                'per taxa, %d taxa: wrong proteins' % n)
+          per_taxa[n] = sorted_dic
+        else:
+          check(sorted_dic == per_taxa[n],
+                'all taxa, %d taxa: not the per taxa proteins' % n)
+  finally:
+    os.chdir(home_dir)
+    shutil.rmtree(tmp_dir)
+    (c.archindex_path, c.archindex_cache, c.taxa,
+     c.archindex_all_taxa) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_DOMAIN_INDEX
+############################################################################
+# build time of the reverse domain index (species_domain_index) against the
+# number of lines of a synthetic domain dump, and arch_to_uniprot lookups
+# on it
+
+def bench_domain_index():
+  print('--- species domain index build time against dump lines ---')
+  taxa = ['SCHMA', 'SCHHA', 'SCHJA', 'HUMAN', 'MOUSE']
+  saved = (c.arch_species_backend, c.arch_species_dump,
+           c.species_domain_index, c.taxa)
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    c.arch_species_backend = 'local'
+    c.arch_species_dump = os.path.join(tmp_dir, 'domain_species.tsv')
+    c.species_domain_index = os.path.join(tmp_dir, 'index.p')
+    c.taxa = ['SCHMA', 'SCHHA', 'SCHJA']
+    for n in [100000, 200000, 400000, 800000]:
+      rand = random.Random(n)
+      with open(c.arch_species_dump, 'w') as f:
+        f.write('uniprot\ttaxa\tdomain\n')
+        for i in range(n):
+          f.write('Q%06d\t%s\tPF%05d.%d\n' % (rand.randint(0, n / 3),
+                  rand.choice(taxa), rand.randint(0, 15000), 12))
+      if os.path.isfile(c.species_domain_index):
+        os.remove(c.species_domain_index)
+      d.species_domain_cache.clear()
+      report('build', n, time_call(d.species_domain_index,
+                                   c.arch_species_dump, c.taxa)[0])
+
+    # reload from the pickle, then look up all domains
+    d.species_domain_cache.clear()
+    report('load pickle', n, time_call(d.species_domain_index,
+                                       c.arch_species_dump, c.taxa)[0])
+    arch_list = ['PF%05d' % i for i in range(15000)]
+    report('arch_to_uniprot lookups', len(arch_list),
+           time_call(d.arch_to_uniprot, arch_list, 'pfam')[0])
+  finally:
+    shutil.rmtree(tmp_dir)
+    d.species_domain_cache.clear()
+    (c.arch_species_backend, c.arch_species_dump, c.species_domain_index,
+     c.taxa) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_PARSER
+############################################################################
+# parse time of archindex output, without running archindex: synthetic
+# captured outputs of uniprot queries (cath and pfam) and architecture
+# queries, parsed with the ARCHINDEX_PARSER functions
+
+def bench_parser():
+  print('--- archindex output parsing, lines per second ---')
+  rand = random.Random(0)
+
+  # uniprot query outputs, a few ':PARENT' records each
+  uniprot_outputs = {'cath': [], 'pfam': []}
+  for i in range(20000):
+    for architecture in ['cath', 'pfam']:
+      lines = [':QUERY P%05d\n' % i]
+      for j in range(rand.randint(1, 4)):
+        if architecture == 'cath':
+          arch = '_'.join(['%d.%d.%dp.%d' % (rand.randint(1, 4),
+                           rand.randint(10, 90), rand.randint(10, 900),
+                           rand.randint(10, 90)) for k in range(3)])
+        else:
+          arch = '.'.join(['PF%05d' % rand.randint(0, 15000)
+                           for k in range(3)])
+        lines.append(':PARENT\t%d\n' % j)
+        lines.append('P%05d\t%d\t%s\t%d\n' % (i, j, arch, j))
+      uniprot_outputs[architecture].append(lines)
+
+  for architecture in ['cath', 'pfam']:
+    outputs = uniprot_outputs[architecture]
+    n_lines = sum(len(lines) for lines in outputs)
+    start = timer()
+    for lines in outputs:
+      d.uniprot_arch_parser(iter(lines), architecture)
+    seconds = timer() - start
+    print('%-28s %10d %10.0f lines/s' % ('uniprot_arch_parser ' +
+          architecture, n_lines, n_lines / seconds))
+
+  # architecture query output, one large ':A' block
+  lines = [':A\tPF00001\n', 'UNIPROT\tN\tARCH\tSPECIES\n']
+  for i in range(200000):
+    lines.append('G%05d\t%d\tPF00001\t%s\n' % (i, i, rand.choice(['SCHMA',
+                 'SCHJA', 'HUMAN'])))
+  lines.append(':END\n')
+  for name, parser in [('arch_uniprot_parser', d.arch_uniprot_parser),
+                       ('arch_taxa_parser', lambda lines:
+                        d.arch_taxa_parser(lines, ['SCHMA', 'SCHJA']))]:
+    start = timer()
+    parser(iter(lines))
+    seconds = timer() - start
+    print('%-28s %10d %10.0f lines/s' % (name, len(lines),
+          len(lines) / seconds))
+############################################################################
+
+
+
+
+############################################################################
+### UNIPROT FLAT FILE
+############################################################################
+# write a synthetic uniprot flat file with n records (accessions P00000,
+# P00001... and secondary accessions Q00000...), return its path
+
+def write_uniprot_dat(tmp_dir, n):
+  rand = random.Random(n)
+  dat_file = os.path.join(tmp_dir, 'uniprot_sprot.dat')
+  with open(dat_file, 'w') as f:
+    for i in range(n):
+      seq = ''.join(rand.choice('ACDEFGHIKLMNPQRSTVWY')
+                    for k in range(rand.randint(50, 400)))
+      taxon = rand.choice(['9606', '6183', '10090'])
+      f.write('ID   TEST%d_HUMAN             Reviewed;         %d AA.\n'
+              % (i, len(seq)))
+      f.write('AC   P%05d; Q%05d;\n' % (i, i))
+      f.write('DT   01-JAN-1990, integrated into UniProtKB/Swiss-Prot.\n')
+      f.write('DE   RecName: Full=Test protein %d;\n' % i)
+      f.write('OS   Homo sapiens (Human).\n')
+      f.write('OC   Eukaryota; Metazoa.\n')
+      f.write('OX   NCBI_TaxID=%s;\n' % taxon)
+      if i % 3 == 0:
+        f.write('DR   PDB; %dABC; X-ray; 2.00 A; A=1-%d.\n' % (i % 10,
+                len(seq)))
+      f.write('SQ   SEQUENCE   %d AA;  1000 MW;  0000000000000000 CRC64;\n'
+              % len(seq))
+      for start in range(0, len(seq), 60):
+        f.write('     ' + ' '.join(seq[k:k + 10] for k in
+                range(start, min(start + 60, len(seq)), 10)) + '\n')
+      f.write('//\n')
+  return dat_file
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_UNIPROT_DAT
+############################################################################
+# local uniprot backend: index build time, and records per second read
+# (raw text) and parsed (uniprot_row) in random order
+
+def bench_uniprot_dat():
+  print('--- local uniprot flat file, records per second ---')
+  saved = (c.uniprot_backend, c.uniprot_dat, c.uniprot_dat_index,
+           c.uniprot_dat_run_size, c.uniprot_failures)
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  try:
+    n = 50000
+    c.uniprot_backend = 'local'
+    c.uniprot_dat = write_uniprot_dat(tmp_dir, n)
+    c.uniprot_dat_index = os.path.join(tmp_dir, 'index.drb')
+    c.uniprot_failures = os.path.join(tmp_dir, 'failures.txt')
+    d.uniprot_dat_cache.clear()
+    d.uniprot_memory.clear()
+
+    # the index held in memory, first record of each name
+    offset_dic = {}
+    for name, start, length in d.uniprot_dat_names(c.uniprot_dat):
+      offset_dic.setdefault(name, (start, length))
+    # one sorted run, then runs merged on disk
+    for run_size in [10 * n, n / 10]:
+      c.uniprot_dat_run_size = run_size
+      if os.path.isfile(c.uniprot_dat_index + '.p'):
+        os.remove(c.uniprot_dat_index + '.p')
+      seconds, (stamp, index_dic) = time_call(d.uniprot_dat_index,
+                                              c.uniprot_dat)
+      report('index build, runs of %d' % run_size, n, seconds)
+      check(dict(index_dic.iteritems()) == offset_dic,
+            'runs of %d: not the offsets of the flat file' % run_size)
+
+    entry_list = ['P%05d' % i for i in range(n)]
+    random.Random(0).shuffle(entry_list)
+    start = timer()
+    for entry in entry_list:
+      d.uniprot_dat_text(entry)
+    seconds = timer() - start
+    print('%-28s %10d %10.0f records/s' % ('read', n, n / seconds))
+
+    start = timer()
+    for entry in entry_list[:10000]:
+      d.uniprot_row(entry)
+    seconds = timer() - start
+    print('%-28s %10d %10.0f records/s' % ('read and parse', 10000,
+          10000 / seconds))
+
+    # entries that are not in the flat file are reported
+    d.uniprot_fetcher.failures.clear()
+    row_dic = d.uniprot_table(['P00001', 'X99999'])
+    check(row_dic['X99999'] is None and
+          d.uniprot_fetcher.failures.keys() == ['X99999'] and
+          open(c.uniprot_failures).read().startswith('X99999\t'),
+          'X99999 is not reported as missing from the flat file')
+  finally:
+    shutil.rmtree(tmp_dir)
+    d.uniprot_dat_cache.clear()
+    d.uniprot_memory.clear()
+    d.uniprot_fetcher.failures.clear()
+    (c.uniprot_backend, c.uniprot_dat, c.uniprot_dat_index,
+     c.uniprot_dat_run_size, c.uniprot_failures) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_FETCHER
+############################################################################
+# uniprot fetcher against a stand-in http server (a thread of this
+# process), with 20 ms of latency per request; every 10th entry answers
+# 503 the first time (retried), a few entries are secondary accessions
+# (redirected to the primary entry) and a few are missing (404, reported
+# as failures)
+# entries per second with one worker and with c.uniprot_workers, and the
+# number of connections opened (keep-alive)
+# the rows and failures are checked against the records served, and the
+# number of requests against the retries and redirects expected
+
+# well formed accession for the batch requests
+accession_format = re.compile('^[A-Z0-9]+$')
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  # keep-alive
+  protocol_version = 'HTTP/1.1'
+  # one write per answer, not one per header line
+  wbufsize = -1
+
+  def setup(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connections = self.server.connections + 1
+
+  def do_GET(self):
+    time.sleep(self.server.latency)
+    with self.server.lock:
+      self.server.requests = self.server.requests + 1
+    # batch, /accessions?accessions=acc1,acc2,...: the records of the
+    # primary accessions found, one after the other; 400 for the whole
+    # batch if one accession is malformed
+    if '?accessions=' in self.path:
+      entry_list = self.path.split('?accessions=', 1)[1].split('&')[0]
+      entry_list = entry_list.split(',')
+      if not all(accession_format.match(entry) for entry in entry_list):
+        self.answer(400, '')
+        return
+      self.answer(200, ''.join(self.server.text_dic.get(entry, '')
+                               for entry in entry_list))
+      return
+    entry = self.path.rsplit('/', 1)[-1].split('.')[0]
+    with self.server.lock:
+      unavailable = entry in self.server.unavailable
+      self.server.unavailable.discard(entry)
+    if unavailable:
+      self.answer(503, '')
+    elif entry in self.server.text_dic:
+      self.answer(200, self.server.text_dic[entry])
+    elif entry in self.server.primary_dic:
+      # secondary accession, see the primary entry
+      self.answer(303, '', self.path.replace(
+          entry, self.server.primary_dic[entry]))
+    else:
+      self.answer(404, '')
+
+  def answer(self, status, body, location=None):
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(body)))
+    if location is not None:
+      self.send_header('Location', location)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn,
+                    BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+# start the server on a free port, {primary accession: text} and
+# {secondary accession: primary accession} from the flat file
+
+def start_stand_in_server(dat_file, latency):
+  text_dic = {}
+  primary_dic = {}
+  with open(dat_file) as f:
+    for record in f.read().split('//\n')[:-1]:
+      accession_list = [accession.strip() for accession in
+                        record.split('AC   ', 1)[1].split('\n', 1)[0]
+                        .split(';') if accession.strip()]
+      text_dic[accession_list[0]] = record + '//\n'
+      for accession in accession_list[1:]:
+        primary_dic[accession] = accession_list[0]
+  server = StandInServer(('127.0.0.1', 0), StandInHandler)
+  server.text_dic = text_dic
+  server.primary_dic = primary_dic
+  server.latency = latency
+  server.unavailable = set()
+  server.lock = threading.Lock()
+  server.connections = 0
+  server.requests = 0
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+# raise AssertionError with message unless condition holds
+
+def check(condition, message):
+  if not condition:
+    raise AssertionError(message)
+
+
+# check the rows of uniprot_table(entry_list) against the records the
+# server holds: each entry has the row of its own record (through the
+# primary accession for a secondary one), except the failed entries
+# {entry: reason}, which are None and are the fetcher's failures and the
+# failures file
+
+def check_table(server, entry_list, row_dic, failed_dic):
+  for entry in entry_list:
+    if entry in failed_dic:
+      check(row_dic[entry] is None, entry + ' should have no row')
+      continue
+    check(row_dic[entry] is not None, entry + ' has no row')
+    primary = server.primary_dic.get(entry, entry)
+    record = d.SwissProt.read(d.StringIO(server.text_dic[primary]))
+    check(row_dic[entry] == d.project_record(entry, record),
+          entry + ' has the row of another record')
+  check(d.uniprot_fetcher.failures == failed_dic,
+        'failures %r, expected %r' % (d.uniprot_fetcher.failures,
+                                      failed_dic))
+  with open(c.uniprot_failures) as f:
+    check(f.read() == ''.join(entry + '\t' + failed_dic[entry] + '\n'
+                              for entry in sorted(failed_dic)),
+          'wrong failures file')
+
+def bench_fetcher():
+  print('--- uniprot fetcher, stand-in http server, entries per second ---')
+  saved = (c.uniprot_backend, c.uniprot_url, c.uniprot_workers,
+           c.uniprot_rate, c.uniprot_backoff, c.uniprot_cache,
+           c.uniprot_failures, c.uniprot_batch)
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  server = None
+  try:
+    n = 200
+    server = start_stand_in_server(write_uniprot_dat(tmp_dir, n), 0.02)
+    c.uniprot_backend = 'expasy'
+    c.uniprot_batch = 1
+    c.uniprot_url = ('http://127.0.0.1:%d/uniprotkb/%%s.txt' %
+                     server.server_address[1])
+    c.uniprot_rate = 0
+    c.uniprot_backoff = 0.01
+    c.uniprot_cache = ''
+    c.uniprot_failures = os.path.join(tmp_dir, 'failures.txt')
+    # 5 missing entries, 5 secondary accessions
+    missing_list = ['P%05d' % i for i in range(n, n + 5)]
+    secondary_list = ['Q%05d' % i for i in range(3, n, n // 5)]
+    entry_list = (['P%05d' % i for i in range(n)] + missing_list +
+                  secondary_list)
+    failed_dic = dict((entry, 'http 404') for entry in missing_list)
+
+    for workers in sorted(set([1, c.uniprot_workers])):
+      c.uniprot_workers = workers
+      # one 503 for these, then the record
+      unavailable = set(entry_list[:n:10])
+      server.unavailable = set(unavailable)
+      server.connections = 0
+      server.requests = 0
+      d.uniprot_memory.clear()
+      d.uniprot_fetcher = d.UniprotFetcher()
+      seconds, row_dic = time_call(d.uniprot_table, entry_list)
+      print('%-28s %10d %10.0f entries/s %4d connections %3d failed' %
+            ('workers ' + str(workers), len(entry_list),
+             len(entry_list) / seconds, server.connections,
+             len(d.uniprot_fetcher.failures)))
+
+      check_table(server, entry_list, row_dic, failed_dic)
+      check(not server.unavailable, 'some 503 were not retried')
+      # one request per entry, plus the retries and the redirects
+      check(server.requests == (len(entry_list) + len(unavailable) +
+                                len(secondary_list)),
+            'unexpected number of requests: %d' % server.requests)
+  finally:
+    if server is not None:
+      server.shutdown()
+      server.server_close()
+    shutil.rmtree(tmp_dir)
+    d.uniprot_memory.clear()
+    d.uniprot_fetcher = d.UniprotFetcher()
+    (c.uniprot_backend, c.uniprot_url, c.uniprot_workers, c.uniprot_rate,
+     c.uniprot_backoff, c.uniprot_cache, c.uniprot_failures,
+     c.uniprot_batch) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_BATCH
+############################################################################
+# uniprot fetcher asking one entry per request, then c.uniprot_batch
+# entries per request (see BENCH_FETCHER for the stand-in server), with
+# c.uniprot_workers; missing entries and secondary accessions are not in
+# the batch answers and are asked again one by one, and one batch holds a
+# malformed accession, refused (400), so all its entries are asked one by
+# one
+# round trips to the server and entries per second
+# the rows and failures are checked against the records served (see
+# check_table), and the number of requests against the one expected
+
+# requests the fetcher should make for entry_list, batch_size at a time
+
+def expected_requests(server, entry_list, batch_size):
+  # secondary accessions of each primary one
+  secondary_dic = {}
+  for secondary, primary in server.primary_dic.items():
+    secondary_dic.setdefault(primary, []).append(secondary)
+
+  requests = 0
+  for start in range(0, len(entry_list), batch_size):
+    batch = entry_list[start:start + batch_size]
+    if len(batch) == 1:
+      single_list = batch
+    elif not all(accession_format.match(entry) for entry in batch):
+      # refused batch
+      requests = requests + 1
+      single_list = batch
+    else:
+      requests = requests + 1
+      # names of the records in the answer
+      found = set()
+      for entry in batch:
+        if entry in server.text_dic:
+          found.add(entry)
+          found.update(secondary_dic.get(entry, []))
+      single_list = [entry for entry in batch if entry not in found]
+    # one request each, plus a redirect for the secondary accessions
+    requests = requests + len(single_list) + len(
+        [entry for entry in single_list if entry in server.primary_dic])
+  return requests
+
+def bench_batch():
+  print('--- uniprot batch requests, stand-in http server ---')
+  saved = (c.uniprot_backend, c.uniprot_url, c.uniprot_batch_url,
+           c.uniprot_batch, c.uniprot_rate, c.uniprot_cache,
+           c.uniprot_failures)
+  tmp_dir = tempfile.mkdtemp(prefix='dr_bench_')
+  server = None
+  try:
+    n = 2000
+    server = start_stand_in_server(write_uniprot_dat(tmp_dir, n), 0.02)
+    address = 'http://127.0.0.1:%d/uniprotkb/' % server.server_address[1]
+    c.uniprot_backend = 'expasy'
+    c.uniprot_url = address + '%s.txt'
+    c.uniprot_batch_url = address + 'accessions?accessions=%s&format=txt'
+    c.uniprot_rate = 0
+    c.uniprot_cache = ''
+    c.uniprot_failures = os.path.join(tmp_dir, 'failures.txt')
+    # 10 missing entries, 10 secondary accessions and a malformed one
+    # among the first entries
+    missing_list = ['P%05d' % i for i in range(n, n + 10)]
+    secondary_list = ['Q%05d' % i for i in range(7, n, n // 10)]
+    entry_list = (['P%05d' % i for i in range(n)] + missing_list +
+                  secondary_list)
+    entry_list.insert(150, 'P0-BAD')
+    failed_dic = dict((entry, 'http 404') for entry in
+                      missing_list + ['P0-BAD'])
+
+    batch_size = c.uniprot_batch
+    for batch in sorted(set([1, batch_size])):
+      c.uniprot_batch = batch
+      server.requests = 0
+      d.uniprot_memory.clear()
+      d.uniprot_fetcher = d.UniprotFetcher()
+      seconds, row_dic = time_call(d.uniprot_table, entry_list)
+      found = len([entry for entry in row_dic if row_dic[entry]])
+      print('%-28s %10d %10.0f entries/s %5d requests %5d found' %
+            ('batch ' + str(batch), len(entry_list),
+             len(entry_list) / seconds, server.requests, found))
+
+      check_table(server, entry_list, row_dic, failed_dic)
+      expected = expected_requests(server, entry_list, batch)
+      check(server.requests == expected,
+            '%d requests, expected %d' % (server.requests, expected))
+  finally:
+    if server is not None:
+      server.shutdown()
+      server.server_close()
+    shutil.rmtree(tmp_dir)
+    d.uniprot_memory.clear()
+    d.uniprot_fetcher = d.UniprotFetcher()
+    (c.uniprot_backend, c.uniprot_url, c.uniprot_batch_url,
+     c.uniprot_batch, c.uniprot_rate, c.uniprot_cache,
+     c.uniprot_failures) = saved
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_JOIN
+############################################################################
+# step 4 big map (dataset_repo) on synthetic dictionaries: 5 targets per
+# drug, 1-2 cath and 0-1 pfam architectures per target, 3 species proteins
+# per cath architecture and 2 more for a quarter of the pfam ones, and
+# targets without architecture; the time should grow linearly with the
+# edges
+# the map is checked against the nested loops the pipeline used before
+# EdgeJoin (chembl_repo, drugbank_repo), map and species proteins
+# (flatten_dic), and the one table join against the targets' architectures
+
+# drug, cath, pfam and species protein dictionaries, 20000 * scale drugs
+
+def make_join_inputs(rand, scale):
+  uniprot_list = ['U%05d' % i for i in range(2000 * scale)]
+  arch_list = ['A%04d' % i for i in range(500 * scale)]
+  drug_dic = dict(('D%06d' % i, rand.sample(uniprot_list, 5))
+                  for i in range(20000 * scale))
+  cath_dic = dict((uniprot, rand.sample(arch_list, rand.randint(1, 2)))
+                  for uniprot in uniprot_list if rand.random() < 0.9)
+  pfam_dic = dict((uniprot, rand.sample(arch_list, 1))
+                  for uniprot in uniprot_list if rand.random() < 0.5)
+  schisto_cath_dic = dict((arch, ['S%05d' % rand.randint(0, 9999)
+                                  for k in range(3)]) for arch in arch_list)
+  schisto_pfam_dic = dict((arch, ['S%05d' % rand.randint(0, 9999)
+                                  for k in range(2)])
+                          for arch in arch_list if rand.random() < 0.25)
+  return drug_dic, cath_dic, schisto_cath_dic, pfam_dic, schisto_pfam_dic
+
+# the big map with the nested loops of chembl_repo: for each drug and
+# target, the cath then pfam architectures, each with its cath then pfam
+# species proteins, kept if there are any
+
+def nested_repo(drug_dic, cath_dic, schisto_cath_dic, pfam_dic,
+                schisto_pfam_dic):
+  repo_map = {}
+  for drug in drug_dic:
+    for target in drug_dic[drug]:
+      arch_list = cath_dic.get(target, []) + pfam_dic.get(target, [])
+      for arch in arch_list:
+        schisto_list = (schisto_cath_dic.get(arch, []) +
+                        schisto_pfam_dic.get(arch, []))
+        if schisto_list:
+          repo_map.setdefault(drug, {}).setdefault(target, {})[arch] = \
+              schisto_list
+  return repo_map
+
+def bench_join():
+  print('--- step 4 map (dataset_repo), drugs ---')
+  rand = random.Random(0)
+  for scale in [1, 4]:
+    inputs = make_join_inputs(rand, scale)
+    seconds, repo_map = time_call(d.dataset_repo, *inputs)
+    report('dataset_repo', len(inputs[0]), seconds)
+    seconds, nested_map = time_call(nested_repo, *inputs)
+    report('nested loops', len(inputs[0]), seconds)
+    check(repo_map == nested_map,
+          'scale %d: dataset_repo is not the nested loops map' % scale)
+    check(d.flatten_dic(repo_map, 'values_4') ==
+          d.flatten_dic(nested_map, 'values_4'),
+          'scale %d: not the species proteins of the nested loops' % scale)
+
+    # one table, {drug: {target: [cath then pfam architectures]}}
+    drug_dic, cath_dic, schisto_cath_dic, pfam_dic, schisto_pfam_dic = \
+        inputs
+    arch_map = {}
+    for drug in drug_dic:
+      for target in drug_dic[drug]:
+        arch_list = cath_dic.get(target, []) + pfam_dic.get(target, [])
+        if arch_list:
+          arch_map.setdefault(drug, {})[target] = arch_list
+    check(d.EdgeJoin([[cath_dic, pfam_dic]]).join(drug_dic) == arch_map,
+          'scale %d: one table join is not the architectures' % scale)
+############################################################################
+
+
+
+
+############################################################################
+### BENCH_SPARSE
+############################################################################
+# step 4 counts on the inputs of BENCH_JOIN: unique species proteins and
+# proteins per drug by walking the big map (flatten_dic), against the
+# sparse matrices (DrugGraph, needs scipy), built once then queried
+# the graph must give the drugs, proteins and counts of the walk
+
+# proteins reached by each drug, walking the big map
+
+def drug_proteins(drug_map):
+  protein_set = set()
+  for target in drug_map:
+    for arch in drug_map[target]:
+      protein_set.update(drug_map[target][arch])
+  return protein_set
+
+def walk_drug_counts(repo_map):
+  return dict((drug, len(drug_proteins(repo_map[drug])))
+              for drug in repo_map)
+
+def walk_counts(repo_map):
+  return d.flatten_dic(repo_map, 'values_4'), walk_drug_counts(repo_map)
+
+# drugs reaching each protein, walking the big map
+
+def walk_protein_counts(repo_map):
+  protein_counts = {}
+  for drug in repo_map:
+    for protein in drug_proteins(repo_map[drug]):
+      protein_counts[protein] = protein_counts.get(protein, 0) + 1
+  return protein_counts
+
+def graph_counts(graph):
+  return graph.reached_proteins(), graph.drug_counts()
+
+def bench_sparse():
+  try:
+    import scipy
+  except ImportError:
+    print('--- step 4 counts, drugs ---')
+    print('scipy is not installed, skipped')
+    return
+  print('--- step 4 counts, drugs (scipy ' + scipy.__version__ + ') ---')
+  rand = random.Random(0)
+  for scale in [1, 4]:
+    inputs = make_join_inputs(rand, scale)
+    repo_map = d.dataset_repo(*inputs)
+    seconds, walked = time_call(walk_counts, repo_map)
+    report('walk big map', len(inputs[0]), seconds)
+    seconds, graph = time_call(d.DrugGraph, *inputs)
+    report('sparse build', len(inputs[0]), seconds)
+    seconds, counted = time_call(graph_counts, graph)
+    report('sparse counts', len(inputs[0]), seconds)
+
+    check(counted[0] == walked[0],
+          'scale %d: reached_proteins is not flatten_dic values_4' % scale)
+    check(counted[1] == walked[1],
+          'scale %d: drug_counts is not the walk of the map' % scale)
+    check(graph.reached_drugs() == d.flatten_dic(repo_map, 'keys'),
+          'scale %d: reached_drugs is not flatten_dic keys' % scale)
+    check(graph.protein_counts() == walk_protein_counts(repo_map),
+          'scale %d: protein_counts is not the walk of the map' % scale)
+############################################################################
+
+
+
+
+############################################################################
+### MAIN
+############################################################################
+# dictionary of benchmark names vs functions
+
+benchmarks = {'step1': bench_step1,
+              'bundle': bench_bundle,
+              'compressed': bench_compressed,
+              'parallel': bench_parallel,
+              'memory': bench_memory,
+              'archindex': bench_archindex,
+              'taxa': bench_taxa,
+              'domain_index': bench_domain_index,
+              'parser': bench_parser,
+              'uniprot_dat': bench_uniprot_dat,
+              'fetcher': bench_fetcher,
+              'batch': bench_batch,
+              'join': bench_join,
+              'sparse': bench_sparse}
+
+def main():
+  # silence the pipeline console logger
+  d.ch.setLevel(d.logging.WARNING)
+
+  # child process of bench_memory
+  if sys.argv[1:2] == ['memory-child']:
+    memory_child(sys.argv[2], sys.argv[3])
+    return
+
+  # names given on the command line, or all of them
+  names = sys.argv[1:] or sorted(benchmarks)
+  for name in names:
+    if name not in benchmarks:
+      print('Unknown benchmark ' + name + ', choose from ' +
+            ', '.join(sorted(benchmarks)))
+      sys.exit()
+    benchmarks[name]()
+
+if __name__ == "__main__":
+  main()
+############################################################################
@@ -151,10 +151,116 @@ model_seq = 'schma'
 
 
 
+############################################################################
+### PERFORMANCE SETTINGS
+############################################################################
+# number of worker processes for loading the reference files of steps 5-6
+# at the same time (1 to load them one after the other)
+load_workers = 4
+
+# seconds to wait for the input files loaded at the same time, before
+# giving up
+load_timeout = 3600
+
+# step 2: where the cath/pfam architectures of the targets come from
+# 'archindex' - one archindex query per target
+# 'local' - index built once from the local mapping files (uniprot_cath,
+# pdb_to_pfam and uniprot_pdb), pfam ids are then only found for the
+# targets with a pdb structure
+arch_backend = 'archindex'
+
+# step 3: where the species' proteins of each cath/pfam id come from
+# 'archindex' - archindex queries, at most 100 proteins per query
+# 'local' - reverse index built once from arch_species_dump (see
+# INPUT_FILES), no limit on the number of proteins
+arch_species_backend = 'archindex'
+
+# where the uniprot records (taxonomy, pdb, sequence...) come from
+# 'expasy' - fetched over http from uniprot_url, several entries at a time
+# 'local' - read from the local flat file uniprot_dat (see INPUT_FILES),
+# indexed once by byte offset; the entries that are not in the file (eg
+# unreviewed entries, with uniprot_sprot.dat) are listed in
+# uniprot_failures (see OUTPUT_FILES)
+uniprot_backend = 'expasy'
+
+# names (accessions and entry names) of uniprot_dat sorted in memory at a
+# time while it is indexed, the sorted runs are merged on disk
+uniprot_dat_run_size = 500000
+
+# uniprot rows (the fields of the records the pipeline uses) kept in
+# memory, the least recently used are dropped first
+uniprot_memory_records = 20000
+
+# uniprot records fetched over http are kept on disk (uniprot_cache, see
+# OUTPUT_FILES) for uniprot_cache_days, as long as uniprot_release is the
+# same; change uniprot_release (eg to the new release name) to fetch all
+# the records again
+uniprot_release = '2014_04'
+uniprot_cache_days = 90
+
+# address of a uniprot entry in the flat file format (the one ExPASy points
+# to), %s is the accession
+uniprot_url = 'https://rest.uniprot.org/uniprotkb/%s.txt'
+
+# number of uniprot entries asked in one request (1 for one request per
+# entry), at uniprot_batch_url, %s is the comma separated accessions; the
+# answer is the flat file records, one after the other
+uniprot_batch = 100
+uniprot_batch_url = ('https://rest.uniprot.org/uniprotkb/accessions?' +
+                     'accessions=%s&format=txt')
+
+# number of uniprot requests run at the same time, each worker keeps its
+# connection open
+uniprot_workers = 8
+
+# at most uniprot_rate requests per second over all workers (0 for no
+# limit)
+uniprot_rate = 10
+
+# failed requests (connection errors, http 429/5xx) are tried again up to
+# uniprot_retries times, first after uniprot_backoff seconds, then twice as
+# long each time
+uniprot_retries = 4
+uniprot_backoff = 1.0
+
+# seconds to wait for an answer
+uniprot_timeout = 60
+
+# number of archindex queries run in one shell (steps 2-3)
+archindex_batch = 50
+
+# number of archindex batches run at the same time (steps 2-3)
+archindex_workers = 4
+
+# step 3: query archindex once per architecture for all species (True),
+# instead of once per architecture and taxa code, and split the proteins
+# by taxa code afterwards, so the cost does not grow with the taxa list
+# the species (taxa code, eg 'SCHMA') of each protein row of archindex -p
+# is read from column archindex_species_column (counted from 0, the uniprot
+# id is column 0); the program aborts on a row without a species code there
+# archindex_all_maxs is the -maxs of these queries, as they cover all
+# species it should be well above the usual 100
+archindex_all_taxa = False
+archindex_species_column = 3
+archindex_all_maxs = 100000
+
+# step 4: count the species proteins reached by the drugs through sparse
+# matrices (drug x target x architecture x protein, needs scipy) instead
+# of walking the big maps, and rank the drugs (drug_ranking, see
+# OUTPUT_FILES); sparse_top is the number of drugs of the ranking logged
+sparse_graph = False
+sparse_top = 10
+############################################################################
+
+
+
+
 ############################################################################
 ### INPUT_FILES
 ############################################################################
 # input files (refer to README for source)
+# any of them can be given compressed (.gz, .bz2, .xz), eg 'all.sdf.gz'
+# (.xz needs the lzma module, backports.lzma on python 2)
 
 # drug file from ChEMBL ('Browse drugs') 'chembl_drugs.txt'
 # number of drugs should be 10406
@@ -177,6 +283,9 @@ drugbank_input = 'small_molecule_target_ids_all.csv'
 # define sdf file with drugbank drugs (contains smiles)
 drugbank_sdf = 'all.sdf'
 
+# read the sdf file through mmap (True) or line by line (False)
+sdf_mmap = False
+
 # uniprot to pdb csv mapping file
 # if necessary, uniprot_pdb.tsv (tsv version) can be retrieved
 uniprot_pdb = "uniprot_pdb.csv"
@@ -198,6 +307,21 @@ pdb_to_pfam = 'pdb_pfam_mapping.txt'
 
 # uniprot to cath residue mapping
 uniprot_cath = 'arch_schema_cath.tsv'
+
+# domain assignment dump for arch_species_backend = 'local', tab-separated
+# (eg archindex export, or pfam/cath mapping files), with the columns of
+# uniprot id, taxa code and domain id (cath or pfam) in arch_species_cols
+arch_species_dump = 'domain_species.tsv'
+arch_species_cols = [0, 1, 2]
+
+# uniprot flat file (uniprot_sprot.dat, uncompressed) for
+# uniprot_backend = 'local'
+uniprot_dat = 'uniprot_sprot.dat'
+
+# compiled input bundle, built with 'python drug_repo.py compile-inputs'
+# the loaders read from it (True) while their source files are unchanged
+bundle_dir = 'dr_bundle'
+use_bundle = True
 ############################################################################
 
 
@@ -214,6 +338,34 @@ uniprot_cath = 'arch_schema_cath.tsv'
 # log
 log_name = 'dr_log.log'
 
+# species index, parsed from spec_list once and then reloaded from here
+species_index = 'dr_species_index.p'
+
+# index of uniprot ids vs cath/pfam ids, built from the local mapping files
+# (arch_backend = 'local')
+domain_index = 'dr_domain_index.p'
+
+# index of cath/pfam ids vs proteins of the taxa, built from
+# arch_species_dump (arch_species_backend = 'local')
+species_domain_index = 'dr_species_domain_index.p'
+
+# byte offset index of uniprot_dat (uniprot_backend = 'local')
+uniprot_dat_index = 'dr_uniprot_dat.drb'
+
+# uniprot record cache (sqlite), '' for no cache on disk
+uniprot_cache = 'dr_uniprot_cache.db'
+
+# uniprot entries that could not be fetched, with the reason ('' for no
+# report)
+uniprot_failures = 'dr_uniprot_failures.txt'
+
+# step 4 drug ranking (sparse_graph = True), %s is the dataset name
+drug_ranking = 'dr_%s_drug_ranking.txt'
+
+# archindex query cache (sqlite), outputs are reused while the archindex
+# binary is unchanged ('' for no cache)
+archindex_cache = 'dr_archindex_cache.db'
+
 #tcoffee log
 t_coffee = 'dr_tcoffee.log'
 
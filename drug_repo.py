@@ -85,22 +85,59 @@ import csv
 # import subprocess for executing command line
 import subprocess
 
+# process pool for loading files in parallel
+import multiprocessing
+
+# thread pool for running archindex queries at the same time
+from multiprocessing.pool import ThreadPool
+
+# archindex query cache
+import sqlite3
+
+# quote archindex arguments for the shell
+import pipes
+
+# uniprot record cache
+import time
+from collections import OrderedDict, namedtuple
+
+# concurrent uniprot fetcher
+import threading, httplib, urlparse, socket
+
 # import itertools for flatten out lists
 import itertools
 
 # izip_longest to split dictionaries into chunks (part 8)
 from itertools import izip_longest
 
+# izip to loop over columns together
+from itertools import izip
+
+# itemgetter to pick the columns of a row
+from operator import itemgetter
+
+# garbage collector, paused while building the big maps
+import gc
+
 # import other modules
 import sys, re, string, fnmatch, shutil
 
 # for http
-from urllib2 import urlopen, HTTPError
+from urllib2 import urlopen
 #import urllib2
 
 from urllib import urlretrieve
-# linecache for jumping to specific lines
-import linecache
+# mmap for reading large files without loading them
+import mmap
+
+# struct, marshal and hashlib for the compiled input bundle
+import struct, marshal, hashlib
+
+# dictionary interface for the binary dictionary files (MmapDic)
+from UserDict import DictMixin
+
+# sorted runs merged on disk (uniprot_dat_index)
+import heapq, tempfile
 
 # datetime
 from datetime import datetime
@@ -117,6 +154,17 @@ class AutoVivification(dict):
 
 import gzip
 import xml.dom.minidom
+
+# bz2 and lzma for compressed input files
+import bz2, io
+try:
+  import lzma
+# python 2 needs backports.lzma for .xz files
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
 ############################################################################
 
 
@@ -139,11 +187,11 @@ Entrez.email = c.your_email
 # import SeqIO
 from Bio import SeqIO
 
-# import expasy for accessing protein sequences
-from Bio import ExPASy
-
 # import swissprot for parsing swissprot plain text files
 from Bio import SwissProt
+
+# read swissprot records from the local flat file
+from cStringIO import StringIO
 ############################################################################
   
 
@@ -180,41 +228,261 @@ if c.steps >= c.modeller_step:
 
 
 ############################################################################
-### HEADER_COUNT
+### OPEN_INPUT
 ############################################################################
-# find specific header in line of comma or tab (or other) separated
-# file and return column number of the header
+# open input file for reading and return the file handle, abort the program
+# if the file is not there
+# compressed files (.gz, .bz2, .xz) are decompressed while they are read,
+# no decompressed copy is written to disk
+
+def compressed_format(text_file):
+  for extension in ['gz', 'bz2', 'xz']:
+    if text_file.endswith('.' + extension):
+      return extension
+  return None
+
+def open_input(text_file):
+  compression = compressed_format(text_file)
+
+  if compression == 'xz' and lzma is None:
+    logger.error('The file ' + text_file + ' is xz compressed, but the ' +
+                 'lzma module (backports.lzma on python 2) is missing!')
+    logger.warning('The program is aborted.')
+    sys.exit()
 
-def header_count(line, separator, header):
-  #set counter to 0
-  col_number = 0
-  # loop until word matches the header
-  while not line.split(separator)[col_number].rstrip('\r\n') == header:
-    col_number = col_number + 1
-  # return column number
-  return col_number
+  try:
+    if compression == 'gz':
+      # buffered, line iteration on the bare gzip file is slow
+      input_handle = io.BufferedReader(gzip.open(text_file, 'rb'))
+    elif compression == 'bz2':
+      input_handle = bz2.BZ2File(text_file, 'r')
+    elif compression == 'xz':
+      input_handle = io.BufferedReader(lzma.open(text_file, 'rb'))
+    else:
+      input_handle = open(text_file, 'r')
+    return input_handle
+  except IOError:
+    logger.error('The file ' + text_file + ' cannot be found' +
+                 ' in the current directory!')
+    logger.warning('The program is aborted.')
+    # exit python
+    sys.exit()
+############################################################################
+
+
+
+
+############################################################################
+### LINE_SOURCE
+############################################################################
+# stream the lines of a (possibly compressed) text file one at a time,
+# instead of holding the whole file as a list of strings
+# with has_header=True the first line is read straight away and kept in
+# .header, iteration then starts from the first data line
+# .line_number is the number of the line last read, for error messages
+# the file is closed when iteration ends (or with close / a with block)
+
+class LineSource(object):
+
+  def __init__(self, text_file, has_header=False):
+    self.text_file = text_file
+    self.header = None
+    self.line_number = 0
+    self.input_handle = open_input(text_file)
+    if has_header:
+      self.header = self.input_handle.readline()
+      if self.header == '':
+        self.error('The file is empty, no headers found')
+      self.line_number = 1
+
+  def __iter__(self):
+    try:
+      for line in self.input_handle:
+        self.line_number += 1
+        yield line
+    except (IOError, EOFError) as e:
+      # eg truncated or corrupted compressed file
+      self.error('Cannot read the file (' + str(e) + ')')
+    finally:
+      self.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    self.input_handle.close()
+
+  # log error with file name and line number, then abort
+  def error(self, message):
+    logger.error(message + ' - ' + self.text_file + ', line ' +
+                 str(self.line_number) + '!')
+    logger.warning('The program is aborted.')
+    sys.exit()
 ############################################################################
 
 
 
+
+############################################################################
+### SCHEMA
+############################################################################
+# columns of a separated file with headers, resolved once from the header
+# line of a LineSource
+# header_list - headers we need, fields are returned in this order
+# quoted=True - rows are read with the csv reader (quotation marks etc.)
+# abort the program if one of the headers is missing, or if a row is too
+# short for the columns we need
+
+class Schema(object):
+
+  def __init__(self, lines, separator, header_list, quoted=False):
+    self.lines = lines
+    self.separator = separator
+    self.header_list = list(header_list)
+    self.quoted = quoted
+
+    # split the header line the same way as the rows
+    header_line = lines.header.rstrip('\r\n')
+    if quoted:
+      headers = next(csv.reader([header_line], delimiter=separator))
+    else:
+      headers = header_line.split(separator)
+
+    missing = [header for header in self.header_list
+               if header not in headers]
+    if missing:
+      lines.line_number = 1
+      lines.error('The headers ' + str(missing) + ' cannot be found')
+
+    # column number of each header
+    self.col_list = [headers.index(header) for header in self.header_list]
+    self.getter = itemgetter(*self.col_list)
+
+  # split one line, stripped of carriage return
+  def split(self, line):
+    return line.rstrip('\r\n').split(self.separator)
+
+  # tuple of the fields we want from a split row
+  def fields(self, rowsplit):
+    try:
+      if len(self.col_list) == 1:
+        return (self.getter(rowsplit),)
+      return self.getter(rowsplit)
+    except IndexError:
+      self.lines.error('The row has fewer columns than the headers')
+
+  # iterate over the data rows, giving the tuple of fields of each
+  def rows(self):
+    if self.quoted:
+      row_iter = csv.reader(self.lines, delimiter=self.separator)
+    else:
+      row_iter = (self.split(line) for line in self.lines)
+    for rowsplit in row_iter:
+      yield self.fields(rowsplit)
+############################################################################
+
+
+
+
 ############################################################################
 ### FILE_TO_LINES
 ############################################################################
-# read file using readlines approach and return the lines
+# read whole file and return the list of lines, only for the few callers
+# that need to go back and forth in the lines (archindex output etc.)
 
 def file_to_lines(text_file):
-  try:
-    input_file = open(text_file, 'r')
-    lines = input_file.readlines()
-    input_file.close()
-    #logger.debug('the try/expect loop is working')
-    return lines
-  except IOError:
-    logger.error('The file ' + text_file + ' cannot be found' +
-                 ' in the current directory!')
+  lines = list(LineSource(text_file))
+  return lines
+############################################################################
+
+
+
+
+############################################################################
+### TXT_TO_COLUMNS
+############################################################################
+# read separated file with headers in a single pass and return dictionary
+# {header: (tuple of values)} for the requested headers only
+# each row is split once and only the columns we need are kept, so the rest
+# of the (possibly huge) file never sits in memory
+
+# columns of the chembl drug file used by process_chembl (step 1), the
+# smiles of step 7 are read by txt_to_dic
+chembl_drug_columns = ["CHEMBL_ID", "DEVELOPMENT_PHASE", "DRUG_TYPE"]
+
+# columns of the chembl drug targets file used by the pipeline (step 1)
+chembl_target_columns = ["MOLECULE_CHEMBL_ID", "TARGET_CHEMBL_ID"]
+
+def txt_to_columns(input_file, separator, header_list):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('txt_to_columns',
+                        (input_file, separator, header_list))
+  if bundled is not None:
+    return bundled
+
+  lines = LineSource(input_file, has_header=True)
+  # resolve the column number of each header
+  schema = Schema(lines, separator, header_list)
+
+  # one list of values per header
+  value_lists = [[] for header in header_list]
+  appends = [values.append for values in value_lists]
+
+  # iterate over rows, excluding the header row
+  for row in schema.rows():
+    for append, value in izip(appends, row):
+      append(value)
+
+  # compact tuples, one per header
+  columns = {}
+  for header, values in zip(header_list, value_lists):
+    columns[header] = tuple(values)
+
+  return columns
+############################################################################
+
+
+
+
+############################################################################
+### INVERT_DIC
+############################################################################
+# invert a mapping in a single pass, returning {value:[list of keys]}
+# duplicated value/key pairs are dropped using a set, the order of the keys
+# in each list is the order in which they are first met
+# flag 'one' - dictionary with single values {key: value}
+# flag 'many' - dictionary with lists as values {key: [list of values]}
+# flag 'pairs' - iterable of (key, value) tuples, eg rows of a mapping file
+
+def invert_dic(mapping, flag):
+  inverted_dic = {}
+  # value/key pairs already added
+  seen = set()
+
+  if flag == 'one':
+    pairs = ((key, mapping[key]) for key in mapping)
+  elif flag == 'many':
+    pairs = ((key, value) for key in mapping for value in mapping[key])
+  elif flag == 'pairs':
+    pairs = mapping
+  else:
+    logger.error('The flag ' + repr(flag) + ' of invert_dic is not ' +
+                 "'one', 'many' or 'pairs'!")
     logger.warning('The program is aborted.')
-    # exit python
     sys.exit()
+
+  for key, value in pairs:
+    if (value, key) not in seen:
+      seen.add((value, key))
+      if value in inverted_dic:
+        inverted_dic[value].append(key)
+      else:
+        inverted_dic[value] = [key]
+
+  return inverted_dic
 ############################################################################
 
 
@@ -226,101 +494,136 @@ def file_to_lines(text_file):
 # read tab-separated mapping file with header and return dictionary with
 # second column as key and first column as values - created for the
 # chemblID uniprot mapping file
+# flag 'one' - each key keeps one value (the last one in the file)
+# flag 'many' - each key keeps the list of all values, eg {chembl:[uniprot]}
+
+def swap_dic(tab_file, flag='one'):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('swap_dic', (tab_file, flag))
+  if bundled is not None:
+    return bundled
 
-def swap_dic(tab_file):
-  lines = file_to_lines(tab_file)
   swap_dictionary = {}
-  counter = 0
-  # iterate over lines
-  for i in range(1,len(lines)):
+  # list of (first column, second column) pairs, for the 'many' flag
+  pairs = []
+  # iterate over lines, skipping the header
+  for line in LineSource(tab_file, has_header=True):
     # split tab
-    splitline = lines[i].split("\t")
-    counter = counter + 1
+    splitline = line.split("\t")
     #logger.debug(splitline[0])
-    # create dictionary, stripping the carriage return
-    swap_dictionary[splitline[1].rstrip('\r\n')] = (splitline[0])
+    if flag == 'one':
+      # create dictionary, stripping the carriage return
+      swap_dictionary[splitline[1].rstrip('\r\n')] = (splitline[0])
+    elif flag == 'many':
+      pairs.append((splitline[0], splitline[1].rstrip('\r\n')))
+
+  if flag == 'many':
+    swap_dictionary = invert_dic(pairs, 'pairs')
   #logger.debug(swap_dictionary)
   return swap_dictionary
 ############################################################################
 
 
 
+############################################################################
+### DRUG_TARGET_INDEX
+############################################################################
+# bidirectional index drug <-> drug target <-> uniprot, filled while reading
+# the input files (one pass each), so that no lookup needs to scan the other
+# dictionaries. The index itself behaves as the usual drug dictionary
+# {drug1:[list of uniprot], drug2:[...]}, so it can be pickled and passed
+# to flatten_dic, dataset_repo, merge_dic etc. like before
+
+class DrugTargetIndex(dict):
+  """Hash-indexed drug/target/uniprot mapping, dict of drug vs uniprot."""
+  def __init__(self):
+    dict.__init__(self)
+    # {drug: [list of targets]}
+    self.drug_targets = {}
+    # {target: [list of drugs]}
+    self.target_drugs = {}
+    # {target: uniprot}
+    self.target_uniprot = {}
+    # {uniprot: [list of targets]}
+    self.uniprot_targets = {}
+    # drug/target pairs seen so far, to skip duplicated rows
+    self.pairs = set()
+
+  def add_drug_target(self, drug, target):
+    # constant time check for duplicates
+    if (drug, target) not in self.pairs:
+      self.pairs.add((drug, target))
+      self.drug_targets.setdefault(drug, []).append(target)
+
+  def add_uniprot_map(self, target_uniprot_dic):
+    # take dictionary {target: uniprot} (eg from swap_dic)
+    self.target_uniprot.update(target_uniprot_dic)
+
+  def build(self):
+    # reverse directions, single pass inversions
+    self.target_drugs = invert_dic(self.drug_targets, 'many')
+    self.uniprot_targets = invert_dic(self.target_uniprot, 'one')
+
+    # populate the drug vs uniprot dictionary, one pass over the drugs
+    self.clear()
+    for drug in self.drug_targets:
+      uniprot_list = []
+      for target in self.drug_targets[drug]:
+        # check if this id is in the mapping dictionary
+        if target in self.target_uniprot:
+          uniprot = self.target_uniprot[target]
+          if uniprot not in uniprot_list:
+            uniprot_list.append(uniprot)
+
+      # check the list is not empty
+      if uniprot_list:
+        self[drug] = uniprot_list
+
+    # the pairs are not needed any more, do not pickle them
+    self.pairs = set()
+
+  def uniprot_drugs(self, uniprot):
+    # list of drugs pointing to the uniprot, through any of its targets
+    drug_list = []
+    for target in self.uniprot_targets.get(uniprot, []):
+      for drug in self.target_drugs.get(target, []):
+        if drug not in drug_list:
+          drug_list.append(drug)
+    return drug_list
+############################################################################
+
+
+
+
 ############################################################################
 ### PROCESS_CHEMBL
 ############################################################################
-# process chembl input file, return dic of chembl ids vs uniprot ids
+# process chembl input file, return DrugTargetIndex of chembl ids vs
+# uniprot ids (a dictionary {chembl id:[list of uniprot]})
 
 def process_chembl(input_file):
-  # open chembldrugs.txt for reading
-  lines = file_to_lines(input_file)
+  # read the columns we need from chembldrugs.txt, splitting each row once
+  # {header: (tuple of values)}
+  columns = txt_to_columns(input_file, "\t", chembl_drug_columns)
+  chembl_ids = columns["CHEMBL_ID"]
+  phases = columns["DEVELOPMENT_PHASE"]
+  mol_types = columns["DRUG_TYPE"]
   # logger.info('The ChEMBL input file contains a total of '
-  #             + str(len(lines)-1) + ' drugs.')
-
-  ### ANALYSE HEADERS AND OBTAIN COLUMN NUMBERS
-  # logger.info(len(lines))
-  # get the headers
-  headers = lines[0]
-
-  col_phase = header_count(headers, "\t", "DEVELOPMENT_PHASE")
-  col_type = header_count(headers, "\t", "DRUG_TYPE")
-  col_chemblid = header_count(headers, "\t", "CHEMBL_ID")
-
-  # count the drugs in the 4+1 classes of clinical phase
-  # set counters for clinical phases to zero
-  phase1 = 0
-  phase2 = 0
-  phase3 = 0
-  phase4 = 0
-  phase_unknown =0
-  # iterate over rows, excluding the header row
-  for i in range(1,len(lines)):
-    # tab separate each row
-    rowsplit = lines[i].split("\t")
-    if (rowsplit[col_phase] == '1'):
-      phase1 = phase1 + 1
-    elif (rowsplit[col_phase] == '2'):
-      phase2 = phase2 + 1
-    elif (rowsplit[col_phase] == '3'):
-      phase3 = phase3 + 1
-    elif (rowsplit[col_phase] == '4'):
-      phase4 = phase4 + 1
-    else:
-      phase_unknown = phase_unknown + 1
-
-  # logger.info('The number of drugs in phase 1 is: ' + str(phase1) +
-  #             '; in phase 2 is: ' + str(phase2) + '; in phase 3 is: ' +
-  #             str(phase3)+'; in phase 4 is: ' + str(phase4) +
-  #             '; in unknown phase is: ' + str(phase_unknown) + '.')
+  #             + str(len(chembl_ids)) + ' drugs.')
   ###
 
 
   ### CLINICAL PHASE AND MOLECULAR TYPE FILTER
   # IN THE END WE OBTAIN CHEMBL_FILT_LIST THAT HAD THE FILTERED CHEMBL IDS
-  # possibly merge THEM TOGETHER!
-
-  # set up empty list to append lines to
-  stripped = []
-  # look over lines, excluding header
-  for y in range(1,len(lines)):
-    # tab separate each row
-    rowsplit2 = lines[y].split("\t")
-    # check if they are in clinical phase we are intereste in
-    if (rowsplit2[col_phase] in c.chembl_phases):
-      # append the stripped lines to the list
-      stripped.append(lines[y])
 
   # empty list in which to store filtered chembl drug ids
   chembl_filt_list = []
-  # loop over, note here there is no header
-  for line in stripped:
-    # tab separate
-    rowsplit3 = line.split("\t")
-    # check if they are of the desired drug type
-    if rowsplit3[col_type] in c.chembl_mol_type:
-      #logger.debug(rowsplit3[col_chemblid])
-
+  # loop over the three columns together
+  for chembl_id, phase, mol_type in izip(chembl_ids, phases, mol_types):
+    # check if they are in clinical phase and of the drug type we want
+    if phase in c.chembl_phases and mol_type in c.chembl_mol_type:
       # make list of chembl ids we are interested in
-      chembl_filt_list.append(rowsplit3[col_chemblid])
+      chembl_filt_list.append(chembl_id)
 
   logger.info('We have filtered the entries in clinical phases ' +
               str(c.chembl_phases) + ' and of molecule type ' +
@@ -329,102 +632,47 @@ def process_chembl(input_file):
   ###
 
 
-  # CREATE DICTIONARY CHEMBL_TARGET_DRUG_DIC IN WHICH TO STORE
-  # {CHEMBL TARGET IDS: (LIST OF CHEMBL DRUG IDS)}
+  # CREATE THE DRUG/TARGET/UNIPROT INDEX, IN ONE PASS OVER THE DRUG TARGETS
+  # FILE AND ONE PASS OVER THE CHEMBL/UNIPROT MAPPING FILE
 
-  # open the drug targets chembl file and get lines
-  drug_targ = file_to_lines(c.chembl_targets)
-  # get column number for two headers we want (chembl ids for mol and targets)
-  col_mol_id = header_count(drug_targ[0], '\t', 'MOLECULE_CHEMBL_ID')
-  col_targ_id = header_count(drug_targ[0], '\t', 'TARGET_CHEMBL_ID')
-  #logger.debug(col_targ_id)
+  # set of filtered chembl ids, membership test is constant time
+  chembl_filt_set = set(chembl_filt_list)
 
-  # empty dictionary
-  chembl_target_drug_dic = {}
+  # read the drug targets chembl file, only the two columns we want
+  # (chembl ids for mol and targets)
+  targ_columns = txt_to_columns(c.chembl_targets, "\t",
+                                chembl_target_columns)
 
-  # list of target chemblids that refer to the drugs we are interested in
-  # ie. small molecules, late clinical stages
-  for i in range(1,len(drug_targ)):
-    rowsplit = drug_targ[i].split("\t")
-    #logger.debug(rowsplit)
+  # empty index, {drug chembl id : [list of uniprot]} once built
+  chembl_index = DrugTargetIndex()
 
-    # get the chembl drug and target id values for the row
-    chembl_drug_id = rowsplit[col_mol_id]
-    chembl_target_id = rowsplit[col_targ_id]
+  # target chemblids that refer to the drugs we are interested in
+  # ie. small molecules, late clinical stages
+  for chembl_drug_id, chembl_target_id in izip(
+                                  targ_columns["MOLECULE_CHEMBL_ID"],
+                                  targ_columns["TARGET_CHEMBL_ID"]):
 
     # only proceed if the target id is not an empty field!
     if chembl_target_id  != "":
 
       # check if the molecule chembl id is one of the drugs we want
-      if chembl_drug_id in chembl_filt_list:
-
-        # check if the target is is already in the dictionary, and extend
-        if chembl_target_id in chembl_target_drug_dic:
-          # try to append stuff to dictionary
-          chembl_target_drug_dic[chembl_target_id].append(chembl_drug_id)
-
-        # else create the new entry in the dictionary
-        else:
-          # create empty list
-          chembl_target_drug_dic[chembl_target_id] = []
-          # append to empty list the value
-          chembl_target_drug_dic[chembl_target_id].append(chembl_drug_id)
+      if chembl_drug_id in chembl_filt_set:
+        chembl_index.add_drug_target(chembl_drug_id, chembl_target_id)
 
   # test to see if there are duplicates drugs
   # positive: tot 2007 but 1596 unique
-  #logger.debug(len(test_duplo))
-  #logger.debug(len(list(set(test_duplo))))
-
-  # number of drugs we could associate with chembl target
-  # this will be a list of lists, so we need to flatten it out
-  drug_ids = list(itertools.chain(*list(chembl_target_drug_dic.values())))
-  #logger.debug(len(drug_ids))
-
-  # eliminate duplicates
-  drug_ids = list(set(drug_ids))
-  #logger.debug(drug_ids)
-
-  ###
-
+  #logger.debug(len(chembl_index.drug_targets))
 
   # create dictionary from the chembl/uniprot mapping file
   # the dictionary will be {'chemblID1':'uniprotid1', etc..}
   # more than one chembl id can point to the same uniprot id!
-  chembl_uniprot_map_dic = swap_dic(c.chembl_uniprot)
-  #logger.debug(chembl_uniprot_map_dic)
-
-
-  # empty dictionary,it will store {drug chembl id : [list of uniprot]}
-  chembl_dic = {}
-
-  # new method to create swap dictionary instead!
-  # loop over unique list of drug ids
-  for drug in drug_ids:
-    # empty target list in which to store target ids
-    target_list = []
-    # loop over dictionary of chembl target ids and drug chembl ids
-    for key in chembl_target_drug_dic:
-      # check if drug is in the list
-      if drug in chembl_target_drug_dic[key]:
-        # append chembl id to list
-        target_list.append(key)
-    #logger.debug(target_list)
-
-    # empty list for uniprot values
-    uniprot_list = []
-    # loop over the list of chembl ids we have just generated
-    for chembl_id in target_list:
-      # check if this id is in the mapping dictionary
-      if chembl_id in chembl_uniprot_map_dic:
-        # append uniprot value to list
-        uniprot_list.append(chembl_uniprot_map_dic[chembl_id])
+  chembl_index.add_uniprot_map(swap_dic(c.chembl_uniprot))
 
-    # check the list is not empty
-    if uniprot_list != []:
-      chembl_dic[drug] = uniprot_list
+  # populate {drug chembl id : [list of uniprot]}
+  chembl_index.build()
 
-  # return dictionary {uniprot1:(list of chembl ids)}
-  return chembl_dic
+  # return index, it behaves as dictionary {chembl id:[list of uniprot]}
+  return chembl_index
 ############################################################################
 
 
@@ -438,36 +686,19 @@ def process_chembl(input_file):
 
 def process_drugbank(input_file):
 
-  # open and read drug_bank input and count number
-  lines = file_to_lines(input_file)
-  # number of entries (remember there is header)
-  # logger.info('The DrugBank input file contains ' + str(len(lines)-1) +
-  #             ' entries.')
-
-  # headers are first line of the file, stripped of carriage return
-  headers = lines[0].rstrip('\r\n')
-  #logger.debug('The DrugBank headers are: ' + headers + '.')
-  # find column number of uniprot and drugbank ids
-  col_uniprot = header_count(headers, "," , "UniProt ID")
-  col_drugbankids = header_count(headers, "," , "Drug IDs")
-  #logger.debug(col_uniprot)
-  #logger.debug(col_drugbankids)
+  # open drug_bank input, streaming the lines after the header
+  lines = LineSource(input_file, has_header=True)
+
+  # find column number of uniprot and drugbank ids in the headers
+  # rows are read with the csv reader - deals with quotation marks etc..
+  schema = Schema(lines, ",", ["UniProt ID", "Drug IDs"], quoted=True)
 
   # empty dictionary in which to store drugbank info
   drugbank_dic = {}
-  # loop over to len(lines), excluding first line (headers)
-  #for i in range(1,3898):
-    #logger.debug(lines[i])
-    # do I need here skipinitialspace=True ??
 
-  # read csv lines with the csv reader - deals with quotation marks etc..
-  incsv = csv.reader(lines)
-  # skip the first line with the headers
-  next(incsv)
-  # loop over each line
-  for line in incsv:
-    #list_check.append(line[col_uniprot])
-    drug_string = line[col_drugbankids]
+  # loop over each row, excluding first line (headers)
+  for uniprot_id, drug_string in schema.rows():
+    #list_check.append(uniprot_id)
     # logger.info(drug_string)
     # list of drubbank ids
     drug_split = drug_string.split(';')
@@ -475,51 +706,490 @@ def process_drugbank(input_file):
     drug_split = [x.strip(' ') for x in drug_split]
     #ogger.debug(drug_split)
       # check if uniprot id is already in the dictionary
-    if line[col_uniprot] in drugbank_dic:
+    if uniprot_id in drugbank_dic:
       # append drug id value to the list in the dictionary
       # the '.extend' prevents the formation of a list of lists!
-      drugbank_dic[line[col_uniprot]].extend(drug_split)
+      drugbank_dic[uniprot_id].extend(drug_split)
     else:
       # populate dictionary with the new entry
-      drugbank_dic[line[col_uniprot]] = drug_split
+      drugbank_dic[uniprot_id] = drug_split
 
   # confirm we are dealing with duplicates
   #logger.debug(len(list_check))
   #logger.debug(len(list(set(list_check))))
 
 
-  # fast and silly way to generate the swap dictionary!
+  # invert {uniprot:[list of drugbank ids]} in a single pass
+  # to obtain {drugbank id:[list of uniprot]}
+  drugbank_swap = invert_dic(drugbank_dic, 'many')
 
-  drugbank_list = list(itertools.chain(*list(drugbank_dic.values())))
-  drugbank_unique = list(set(drugbank_list))
+  #logger.debug(drugbank_swap)
 
-  #logger.debug(len(drugbank_unique))
+  # return dictionary {drugbank id:[list of uniprot]}
+  return drugbank_swap
+############################################################################
 
 
 
-  drugbank_swap = {}
 
-  # loop over list of unique drugbank ids
-  for drug in drugbank_unique:
-    #empty list for the uniprot values
-    uniprot_list = []
-    for uniprot in drugbank_dic:
-      for db in drugbank_dic[uniprot]:
-        if db == drug:
-          # append uniprot value to the list
-          uniprot_list.append(uniprot)
+############################################################################
+### RUN_ARCHINDEX
+############################################################################
+# run archindex queries and parse their output
+# queries run in batches of c.archindex_batch, each batch in one shell
+# instead of one shell per query, and the batches run at the same time in a
+# pool of c.archindex_workers threads
+# the output is read from the pipe as it comes (no temp file) and handed
+# line by line to parser(lines), whose return value is kept
+# each query is a tuple (option, id, flag, taxa code, maxa, maxs), eg
+# ('-u', 'P12345', '-cath', '', 1, 1) or ('-p', 'PF00001', '', 'SCHMA', 1,
+# 100)
+# return the list of parser results, in the order of query_list
+# outputs are cached in the sqlite database c.archindex_cache, only the
+# queries that are not there yet (or were run with another archindex
+# binary) are run
+
+# archindex arguments of a query
+def archindex_args(query):
+  option, query_id, flag, taxa_code, maxa, maxs = query
+  args = [option, str(query_id), "-maxa", str(maxa), "-maxs", str(maxs)]
+  if flag:
+    args.append(flag)
+  if taxa_code:
+    args.extend(["-s", taxa_code])
+  return args
+
+# run a batch of queries in one shell, reading its output from the pipe
+# after each query, the shell prints an end marker line with the exit code
+# of archindex, where the output of the next query starts
+# return the list of (output lines, parser result), output lines are None
+# if archindex failed
+
+archindex_end = '#DR_QUERY_END'
+
+def archindex_batch(query_list, parser):
+  script = []
+  for query in query_list:
+    script.append(c.archindex_path + " " +
+                  " ".join(pipes.quote(arg) for arg in archindex_args(query)))
+    script.append('echo "' + archindex_end + ' $?"')
+  process = subprocess.Popen("; ".join(script), shell=True,
+                             stdout=subprocess.PIPE)
+  line_iter = iter(process.stdout.readline, '')
+
+  output_list = []
+  for query in query_list:
+    raw_lines = []
+    exit_code = []
+
+    # lines of this query, kept for the cache while the parser reads them
+    def query_lines():
+      for line in line_iter:
+        if archindex_end in line:
+          # last line of the output may have no carriage return
+          head, tail = line.split(archindex_end, 1)
+          if head:
+            raw_lines.append(head)
+            yield head
+          exit_code.append(tail.strip())
+          return
+        raw_lines.append(line)
+        yield line
+
+    lines = query_lines()
+    parsed = parser(lines)
+    # whatever the parser did not read, up to the end marker
+    for line in lines:
+      pass
 
-    # sanity check the list is not empty
-    if uniprot_list:
-    # the list is now ready, populate the dictionary
-      drugbank_swap[drug] = uniprot_list
+    if exit_code != ['0']:
+      logger.warning('archindex ' + ' '.join(archindex_args(query)) +
+                     ' failed (exit code ' + ''.join(exit_code) + ').')
+      raw_lines = None
+    output_list.append((raw_lines, parsed))
+
+  process.stdout.close()
+  process.wait()
+  return output_list
+
+def run_archindex(query_list, parser):
+  # outputs we already have, {query: lines}
+  cache = ArchindexCache(c.archindex_cache)
+  cached_dic = cache.get_many(query_list)
+  # {query: parser result}
+  parsed_dic = {}
+  # queries to run, without duplicates
+  to_run = []
+  for query in query_list:
+    if query in parsed_dic:
+      continue
+    if query in cached_dic:
+      parsed_dic[query] = parser(iter(cached_dic[query]))
+    else:
+      parsed_dic[query] = None
+      to_run.append(query)
+  logger.debug('archindex: ' + str(len(query_list) - len(to_run)) +
+               ' cached queries, ' + str(len(to_run)) + ' to run.')
+
+  # check the binary is there before starting the workers
+  if to_run and not os.access(c.archindex_path, os.X_OK):
+    cache.close()
+    logger.error('The archindex binary ' + c.archindex_path +
+                 ' cannot be found or run!')
+    logger.warning('The program is aborted.')
+    sys.exit()
+
+  batch_size = max(c.archindex_batch, 1)
+  batch_list = [to_run[start:start + batch_size]
+                for start in range(0, len(to_run), batch_size)]
+
+  workers = min(c.archindex_workers, len(batch_list))
+  if workers <= 1:
+    batch_outputs = [archindex_batch(batch, parser) for batch in batch_list]
+  else:
+    pool = ThreadPool(workers)
+    try:
+      # map keeps the order of the batches
+      batch_outputs = pool.map(lambda batch: archindex_batch(batch, parser),
+                               batch_list, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  # merge, in the order of query_list
+  run_list = []
+  for outputs in batch_outputs:
+    run_list.extend(outputs)
+  for query, (raw_lines, parsed) in izip(to_run, run_list):
+    parsed_dic[query] = parsed
+  # only store the outputs of successful runs
+  cache.put_many((query, raw_lines)
+                 for query, (raw_lines, parsed) in izip(to_run, run_list)
+                 if raw_lines is not None)
+  cache.close()
+
+  parsed_list = [parsed_dic[query] for query in query_list]
+  return parsed_list
+
+
+# sqlite cache of archindex outputs, keyed by query and by archindex
+# version (md5 of the binary)
+# with an empty file name nothing is cached
+
+class ArchindexCache(object):
+
+  def __init__(self, cache_file):
+    self.connection = None
+    if not cache_file:
+      return
+    if os.path.isfile(c.archindex_path):
+      self.version = file_checksum(c.archindex_path)
+    else:
+      self.version = ''
+    self.connection = sqlite3.connect(cache_file)
+    # keep str, not unicode
+    self.connection.text_factory = str
+    self.connection.execute(
+        'CREATE TABLE IF NOT EXISTS archindex (option TEXT, id TEXT, ' +
+        'flag TEXT, taxa TEXT, maxa INTEGER, maxs INTEGER, version TEXT, ' +
+        'output TEXT, PRIMARY KEY (option, id, flag, taxa, maxa, maxs, ' +
+        'version))')
+
+  # {query: lines} for the queries in the cache
+  def get_many(self, query_list):
+    cached_dic = {}
+    if self.connection is None:
+      return cached_dic
+    for query in set(query_list):
+      row = self.connection.execute(
+          'SELECT output FROM archindex WHERE option=? AND id=? AND ' +
+          'flag=? AND taxa=? AND maxa=? AND maxs=? AND version=?',
+          query + (self.version,)).fetchone()
+      if row is not None:
+        cached_dic[query] = row[0].splitlines(True)
+    return cached_dic
+
+  # store (query, lines) pairs
+  def put_many(self, query_lines):
+    if self.connection is None:
+      return
+    with self.connection:
+      self.connection.executemany(
+          'INSERT OR REPLACE INTO archindex VALUES (?,?,?,?,?,?,?,?)',
+          (query + (self.version, ''.join(lines))
+           for query, lines in query_lines))
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+############################################################################
+
+
+
+
+############################################################################
+### ARCHINDEX_PARSER
+############################################################################
+# parse archindex output in a single pass, line by line, with small state
+# machines (no going back and forth in the lines)
+# two kinds of records:
+# - uniprot queries (-u): the line after each ':PARENT' line, whose third
+#   column is the architecture, eg '4.10.400.10p_1.10.8.10' (cath) or
+#   'PF00001.PF00002' (pfam)
+# - architecture queries (-p): the lines after the line that starts with
+#   ':A' and the one after it (headers), until a line that starts with colon,
+#   whose first column is the uniprot id
+
+# cath format eg '4.10.400.10'
+cath_format = re.compile(r'.*\..*\..*\..*')
+
+# yield the split line after each ':PARENT' line (uniprot queries)
+def parent_records(lines):
+  # previous line starts with parent
+  after_parent = False
+  for line in lines:
+    if after_parent:
+      yield line.split("\t")
+    # find line that starts with parent
+    after_parent = (line[0:7] == ':PARENT')
+
+# states of arch_rows
+scan_state, head_state, row_state = range(3)
+
+# yield the split rows of the ':A' blocks (architecture queries)
+def arch_rows(lines):
+  state = scan_state
+  for line in lines:
+    if state == head_state:
+      state = row_state
+      continue
+    elif state == row_state:
+      row = line.rstrip('\r\n').split("\t")
+      # while the line is not finishing line
+      if row[0][0:1] != ':':
+        yield row
+        continue
+      state = scan_state
+
+    # find line that starts with ':A'
+    if line[0:2] == ':A':
+      state = head_state
+
+# split architecture string in domain ids
+# cath - get rid of 'p's, split at underscores, keep cath formatted ids
+# pfam - split at dots
+def split_arch(arch_string, architecture):
+  if architecture == "cath":
+    return [item for item in arch_string.replace('p', '').split("_")
+            if cath_format.match(item)]
+  elif architecture == "pfam":
+    return arch_string.split(".")
+
+# parse archindex output lines of one uniprot id, return the list of
+# architectures
+def uniprot_arch_parser(lines, architecture):
+  #list in which to store list of CATH domains for each entry
+  architect_list = []
+  for line_split in parent_records(lines):
+    architect_list.extend(split_arch(line_split[2], architecture))
+  return architect_list
+
+# parse archindex output lines of one arch value and taxa code, return the
+# list of uniprot ids (first column of the rows)
+def arch_uniprot_parser(lines):
+  uniprot_list = [row[0] for row in arch_rows(lines)]
+  return uniprot_list
+
+# species code format eg 'SCHMA'
+species_code_format = re.compile(r'^[A-Z0-9]{1,5}$')
+
+# parse archindex output lines of one arch value queried for all species,
+# return dictionary {taxa code: [list of uniprot ids]} for the codes in
+# taxa_list
+# the species of a row is in column c.archindex_species_column (see
+# archindex_all_taxa in config.py); a row without a species code there
+# raises ValueError, rather than being dropped from the split
+def arch_taxa_parser(lines, taxa_list):
+  taxa_set = set(taxa_list)
+  taxa_dic = {}
+  column = c.archindex_species_column
+  for row in arch_rows(lines):
+    if len(row) <= column or not species_code_format.match(row[column]):
+      raise ValueError('The archindex row ' + repr('\t'.join(row)) +
+                       ' has no species code in column ' + str(column) +
+                       '.')
+    if row[column] in taxa_set:
+      taxa_dic.setdefault(row[column], []).append(row[0])
+  return taxa_dic
+############################################################################
+
+
+
+
+############################################################################
+### DOMAIN_INDEX
+############################################################################
+# build index of uniprot ids vs domains from the local mapping files, as an
+# alternative to archindex in step 2 (c.arch_backend = 'local')
+# return dictionary {'cath': {uniprot: [cath ids]}, 'pfam': {uniprot: [pfam
+# ids]}}
+# cath ids come from the uniprot/cath file (arch_schema_cath.tsv, uniprot
+# id in column 0 and cath id in column 3), pfam ids from the pdb/pfam file
+# (pdb_pfam_mapping.txt, pdb id in column 0 and pfam accession.version in
+# column 4) through the uniprot/pdb file (uniprot_pdb.csv)
+# NB pfam ids are only found for the uniprot ids with a pdb structure
+# the index is pickled to c.domain_index together with size and
+# modification time of the three files, and only rebuilt when they change
+
+# cath format eg '4.10.400.10'
+cath_id_format = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+# index loaded in this run, (file stamps, index dictionary)
+domain_index_cache = {}
+
+def domain_index(cath_file, pfam_file, uniprot_pdb_file):
+  # size and modification time of the mapping files
+  stamp = []
+  for file_name in [cath_file, pfam_file, uniprot_pdb_file]:
+    if not os.path.isfile(file_name):
+      logger.error('The file ' + file_name + ' cannot be found' +
+                   ' in the current directory!')
+      logger.warning('The program is aborted.')
+      sys.exit()
+    file_stat = os.stat(file_name)
+    stamp.append((file_name, file_stat.st_size, file_stat.st_mtime))
+  stamp = tuple(stamp)
+
+  # already loaded in this run
+  if domain_index_cache.get('stamp') == stamp:
+    return domain_index_cache['index']
+
+  index_dic = None
+
+  # check if pickled index exists and is up to date
+  if os.path.isfile(c.domain_index):
+    with open(c.domain_index, 'rb') as f:
+      pickled_stamp, pickled_dic = pickle.load(f)
+    if pickled_stamp == stamp:
+      index_dic = pickled_dic
+
+  # otherwise read the mapping files, one pass each
+  if index_dic is None:
+    cath_dic = {}
+    for line in LineSource(cath_file):
+      cath_split = line.rstrip('\r\n').split("\t")
+      # skip headers and malformed lines
+      if len(cath_split) > 3 and cath_id_format.match(cath_split[3]):
+        cath_dic.setdefault(cath_split[0], set()).add(cath_split[3])
+
+    # {pdb id: set of pfam ids}
+    pdb_pfam = {}
+    for line in LineSource(pfam_file):
+      pfam_split = line.rstrip('\r\n').split("\t")
+      if len(pfam_split) > 4 and pfam_split[4].startswith('PF'):
+        pfam_id = pfam_split[4].split(".")[0]
+        pdb_pfam.setdefault(pfam_split[0].upper(), set()).add(pfam_id)
+
+    pfam_dic = {}
+    for uniprot_id, pdb_list in csv_to_dic(uniprot_pdb_file).iteritems():
+      pfam_set = set()
+      for pdb in pdb_list:
+        pfam_set.update(pdb_pfam.get(pdb.upper(), ()))
+      if pfam_set:
+        pfam_dic[uniprot_id] = pfam_set
+
+    index_dic = {'cath': {}, 'pfam': {}}
+    for architecture, arch_sets in [('cath', cath_dic), ('pfam', pfam_dic)]:
+      for uniprot_id in arch_sets:
+        index_dic[architecture][uniprot_id] = sorted(arch_sets[uniprot_id])
+
+    with open(c.domain_index, 'wb') as f:
+      pickle.dump((stamp, index_dic), f, pickle.HIGHEST_PROTOCOL)
+
+  domain_index_cache['stamp'] = stamp
+  domain_index_cache['index'] = index_dic
+
+  return index_dic
+############################################################################
+
+
+
+
+############################################################################
+### SPECIES_DOMAIN_INDEX
+############################################################################
+# build reverse index of domains vs proteins of the species in taxa_list,
+# from a local domain assignment dump, as an alternative to archindex in
+# step 3 (c.arch_species_backend = 'local')
+# the dump is tab-separated, with uniprot id, taxa code and domain id (cath
+# or pfam) in columns c.arch_species_cols, eg 'G4LW33\tSCHMA\tPF00850'
+# only lines of the taxa in taxa_list are kept (so a header line is skipped)
+# return dictionary {domain id: {taxa code: [uniprot ids]}}, with no limit
+# on the number of proteins
+# the index is pickled to c.species_domain_index together with size and
+# modification time of the dump and the taxa list, and only rebuilt when
+# they change
+
+# index loaded in this run, (stamp, index dictionary)
+species_domain_cache = {}
+
+def species_domain_index(dump_file, taxa_list):
+  if not os.path.isfile(dump_file):
+    logger.error('The file ' + dump_file + ' cannot be found' +
+                 ' in the current directory!')
+    logger.warning('The program is aborted.')
+    sys.exit()
+  file_stat = os.stat(dump_file)
+  stamp = (dump_file, file_stat.st_size, file_stat.st_mtime,
+           tuple(sorted(taxa_list)))
 
+  # already loaded in this run
+  if species_domain_cache.get('stamp') == stamp:
+    return species_domain_cache['index']
 
+  index_dic = None
 
-  #logger.debug(drugbank_swap)
+  # check if pickled index exists and is up to date
+  if os.path.isfile(c.species_domain_index):
+    with open(c.species_domain_index, 'rb') as f:
+      pickled_stamp, pickled_dic = pickle.load(f)
+    if pickled_stamp == stamp:
+      index_dic = pickled_dic
 
-  # return dictionary {uniprot1:(list of drugbank ids)}
-  return drugbank_swap
+  # otherwise read the dump, one pass
+  if index_dic is None:
+    taxa_set = set(taxa_list)
+    col_uniprot, col_taxa, col_domain = c.arch_species_cols
+    # lines shorter than this are skipped
+    col_count = max(c.arch_species_cols) + 1
+    # {domain id: {taxa code: set of uniprot ids}}
+    set_dic = {}
+    for line in LineSource(dump_file):
+      line_split = line.rstrip('\r\n').split("\t")
+      if len(line_split) < col_count:
+        continue
+      if line_split[col_taxa] in taxa_set:
+        # no version on pfam ids
+        domain_id = line_split[col_domain]
+        if domain_id.startswith('PF'):
+          domain_id = domain_id.split(".")[0]
+        taxa_dic = set_dic.setdefault(domain_id, {})
+        taxa_dic.setdefault(line_split[col_taxa], set()).add(
+                                                      line_split[col_uniprot])
+
+    index_dic = {}
+    for domain_id in set_dic:
+      index_dic[domain_id] = {}
+      for taxa_code in set_dic[domain_id]:
+        index_dic[domain_id][taxa_code] = sorted(set_dic[domain_id][taxa_code])
+
+    with open(c.species_domain_index, 'wb') as f:
+      pickle.dump((stamp, index_dic), f, pickle.HIGHEST_PROTOCOL)
+
+  species_domain_cache['stamp'] = stamp
+  species_domain_cache['index'] = index_dic
+
+  return index_dic
 ############################################################################
 
 
@@ -541,73 +1211,24 @@ def uniprot_to_arch(uniprot_list,architecture):
 
   # dictionary of uniprot ids and list of correposponding architectures
   arch_dic = {}
-  numb_unipr = 0
-  # loop over list of uniprot values
-  for uniprot_id in uniprot_list:
-    # logger.info(uniprot_id)
-    numb_unipr = numb_unipr + 1
-    # logger.info('Processing ' + str(numb_unipr))
-    #list in which to store list of CATH domains for each entry
-    architect_list = []
-    # call archschema on the list
-    subprocess.call(c.archindex_path + " -u " + str(uniprot_id) +
-                    " -maxa 1 -maxs 1 " + str(flag) +" > dr_temp.txt", 
-                    shell=True)
-    # store lines
-    lines = file_to_lines('dr_temp.txt')
-    #logger.debug(lines)
-    for i in range(len(lines)):
-      # find line that starts with parent
-      if lines[i][0:7] == ':PARENT':
-        # take the line after the ':PARENT' and split it
-        line_split = lines[i+1].split("\t")
-        #logger.debug('the line after is ' + str(line_split))
-
-
-        ### for cath ###
-        if architecture == "cath":
-          # cath format eg '4.10.400.10'
-          cath_format = re.compile('.*\..*\..*\..*')
-          
-          # check if there are 'p's and get rid of them
-          if "p" in line_split[2]:
-            # replace p's with nothing
-            line_nops = line_split[2].replace('p','')
-          else:
-            line_nops = line_split[2]
-
-          # check if there are undescores
-          if "_" in line_nops:
-            undersc_split = line_nops.split("_")
-            #logger.debug(undersc_split)
-
-            for item in undersc_split:
-              # check if the format is CATH one
-              if cath_format.match(item):
-                architect_list.append(item)
-
-          # this is the case of just one entry, no undescores
-          else:
-            # check the format is CATH one
-            if cath_format.match(line_nops):
-              architect_list.append(line_nops)
-
-
-        ### for pfam ###
-        elif architecture == "pfam":
-          # check if there are dots
-          if "." in line_split[2]:
-            dot_split = line_split[2].split(".")
-            #logger.debug(undersc_split)
-
-            for item in dot_split:
-
-              architect_list.append(item)
-
-          # this is the case of just one entry
-          else:
-            architect_list.append(line_split[2])
 
+  # look the uniprot ids up in the local domain index instead
+  if c.arch_backend == 'local':
+    index_dic = domain_index(c.uniprot_cath, c.pdb_to_pfam,
+                             c.uniprot_pdb)[architecture]
+    for uniprot_id in uniprot_list:
+      if uniprot_id in index_dic:
+        arch_dic[uniprot_id] = list(index_dic[uniprot_id])
+    return arch_dic
+
+  # call archschema on the list, parsing each output as it comes
+  query_list = [("-u", str(uniprot_id), flag, "", 1, 1)
+                for uniprot_id in uniprot_list]
+  parser = lambda lines: uniprot_arch_parser(lines, architecture)
+  parsed_list = run_archindex(query_list, parser)
+
+  # loop over list of uniprot values and their architectures
+  for uniprot_id, architect_list in izip(uniprot_list, parsed_list):
     # logger.info(architect_list)
     # check list is not empty
     if architect_list:
@@ -620,9 +1241,6 @@ def uniprot_to_arch(uniprot_list,architecture):
 
   #logger.debug(cath_dic)
       # logger.info(arch_dic)
-  # rm temp.txt in the end
-  # this is the last temp file that overwrote the others
-  subprocess.call("rm dr_temp.txt", shell=True)
 
   # return dic
   return arch_dic
@@ -638,48 +1256,56 @@ def uniprot_to_arch(uniprot_list,architecture):
 
 def arch_to_uniprot(arch_list,architecture):
 
-  spam = 0
-
   if architecture == "cath":
     flag = "-cath"
   elif architecture == "pfam":
     flag = ""
-  
-  # regex starts with colon
-  starts_colon = re.compile(':.*')
-
 
   # empty dictionary
   uniprot_dic = {}
+
+  # look the arch values up in the local reverse index instead
+  if c.arch_species_backend == 'local':
+    index_dic = species_domain_index(c.arch_species_dump, c.taxa)
+    for arch_id in arch_list:
+      taxa_dic = index_dic.get(arch_id, {})
+      uniprot_list = []
+      for taxa_code in c.taxa:
+        uniprot_list.extend(taxa_dic.get(taxa_code, []))
+      if uniprot_list:
+        uniprot_dic[arch_id] = list(set(uniprot_list))
+    return uniprot_dic
+
+  if c.archindex_all_taxa:
+    # call archschema on the list, one query per arch value for all
+    # species, split by taxa code afterwards
+    query_list = [("-p", str(arch_id), flag, "", 1, c.archindex_all_maxs)
+                  for arch_id in arch_list]
+    parser = lambda lines: arch_taxa_parser(lines, c.taxa)
+    try:
+      taxa_dic_list = run_archindex(query_list, parser)
+    except ValueError as e:
+      logger.error(str(e) + ' Please check archindex_species_column in ' +
+                   'config.py, or set archindex_all_taxa to False!')
+      logger.warning('The program is aborted.')
+      sys.exit()
+    parsed_iter = (taxa_dic.get(taxa_code, [])
+                   for taxa_dic in taxa_dic_list for taxa_code in c.taxa)
+  else:
+    # call archschema on the list, one query per arch value and taxa code
+    # (schisto species), parsing each output as it comes
+    query_list = [("-p", str(arch_id), flag, taxa_code, 1, 100)
+                  for arch_id in arch_list for taxa_code in c.taxa]
+    parsed_iter = iter(run_archindex(query_list, arch_uniprot_parser))
+
   # loop over list of arch values
   for arch_id in arch_list:
-    spam = spam + 1
-    # logger.info(spam)
     # empty list in which to store uniprot values
     uniprot_list = []
     # iterate over the taxa code list (schisto species)
     for taxa_code in c.taxa:
-      # call archschema on the list
-      subprocess.call(c.archindex_path + " -p " + str(arch_id) +
-                    " -maxa 1 -maxs 100 " + str(flag) + " -s " + taxa_code +
-                    " > dr_temp.txt", shell=True)
-      # store lines
-      lines = file_to_lines('dr_temp.txt')
-      #logger.info(lines)
-
-      # get the uniprot values and append them to uniprot_list
-      for i in range(len(lines)):
-        # find line that starts with parent
-        if lines[i][0:2] == ':A':
-          
-          counter = 0
-          # while the line is not finishing line
-          while not starts_colon.match(lines[i+2+counter].split("\t")[0]):
-            # take the line' and split it
-            line_split = lines[i+2+counter].split("\t")
-            uniprot_list.append(line_split[0])
-            counter = counter +1
-
+      # uniprot values for this arch value and taxa code
+      uniprot_list.extend(next(parsed_iter))
 
     # check list is not empty
     if uniprot_list:
@@ -689,10 +1315,6 @@ def arch_to_uniprot(arch_list,architecture):
       # populate the dictionary
       uniprot_dic[arch_id] = uniprot_list
 
-  # rm temp.txt in the end
-  # this is the last temp file that overwrote the others
-  subprocess.call("rm dr_temp.txt", shell=True)
-
   #return the dictionary
   return uniprot_dic
 ############################################################################
@@ -715,6 +1337,621 @@ def merge_lists(list1, list2):
 
 
 
+############################################################################
+### UNIPROT_RECORD
+############################################################################
+# uniprot records, projected to the fields the pipeline uses (UniprotRow):
+# each entry is fetched and parsed once, and the filters (expasy_filter,
+# expasy_dic) and reports (uniprot_to_fasta, percent_identity) all read
+# these rows, or None for the entries that cannot be retrieved (obsolete
+# entry, http error...) or parsed (listed in c.uniprot_failures)
+# c.uniprot_backend = 'expasy' - fetch the entry from uniprot over http,
+# c.uniprot_url (the address ExPASy.get_sprot_raw reads from), see
+# UNIPROT_FETCHER
+# c.uniprot_backend = 'local' - read the entry from the local flat file
+# c.uniprot_dat (uniprot_sprot.dat, uncompressed), through an index of
+# byte offsets so that the file is never loaded as a whole
+# rows are cached at two levels, so that each entry is fetched at most
+# once per uniprot release:
+# - in memory, the last c.uniprot_memory_records rows (LRU), or None for
+#   the entries that could not be retrieved
+# - on disk, the text of the entries fetched over http, in the sqlite
+#   database c.uniprot_cache, tagged with c.uniprot_release and the time
+#   they were fetched; entries of another release or older than
+#   c.uniprot_cache_days are fetched again
+
+# accession - the entry as requested
+# taxonomy_id - first ncbi taxonomy id of the organism, eg '6183'
+# data_class - 'Reviewed' or 'Unreviewed'
+# pdb - tuple of the pdb ids in the cross references, eg ('1ABC', '2XYZ')
+# sequence, length - protein sequence and its length
+UniprotRow = namedtuple('UniprotRow', ['accession', 'taxonomy_id',
+                                       'data_class', 'pdb', 'sequence',
+                                       'length'])
+
+def uniprot_row(entry):
+  return uniprot_table([entry])[entry]
+
+
+# rows of a list of entries, {entry: UniprotRow or None}
+# the entries missing from the caches are fetched together, so that the
+# http requests run concurrently
+
+def uniprot_table(entry_list):
+  row_dic = {}
+  to_read = []
+  for entry in entry_list:
+    if entry in row_dic:
+      continue
+    # memory cache
+    if entry in uniprot_memory:
+      row_dic[entry] = uniprot_memory[entry]
+    else:
+      row_dic[entry] = None
+      to_read.append(entry)
+
+  text_dic = uniprot_texts(to_read)
+  unreadable = 0
+  for entry in to_read:
+    text = text_dic[entry]
+    row = None
+    if text:
+      try:
+        row = project_record(entry, SwissProt.read(StringIO(text)))
+      except ValueError as e:
+        # also SwissProt.SwissProtParserError, a ValueError; the entry is
+        # reported with the ones that cannot be retrieved
+        uniprot_fetcher.failures[entry] = ('unreadable record: ' +
+                                           ' '.join(str(e).split()))
+        unreadable = unreadable + 1
+    uniprot_memory[entry] = row
+    row_dic[entry] = row
+
+  if unreadable:
+    logger.warning(str(unreadable) + ' of ' + str(len(to_read)) +
+                   ' uniprot entries cannot be read, they are listed in ' +
+                   c.uniprot_failures)
+    uniprot_fetcher.write_failures()
+
+  return row_dic
+
+
+# UniprotRow of a swissprot record
+
+def project_record(entry, record):
+  if record.taxonomy_id:
+    taxonomy_id = record.taxonomy_id[0]
+  else:
+    taxonomy_id = None
+  pdb = tuple(ref[1] for ref in record.cross_references if ref[0] == 'PDB')
+  return UniprotRow(entry, taxonomy_id, record.data_class, pdb,
+                    record.sequence, len(record.sequence))
+
+
+# text of the entries in the flat file format, {entry: text or None}
+
+def uniprot_texts(entry_list):
+  if c.uniprot_backend == 'local':
+    text_dic = dict((entry, uniprot_dat_text(entry)) for entry in entry_list)
+    # eg unreviewed entries, with the swissprot file
+    missing = [entry for entry in entry_list if text_dic[entry] is None]
+    if missing:
+      for entry in missing:
+        uniprot_fetcher.failures[entry] = 'not in ' + c.uniprot_dat
+      logger.warning(str(len(missing)) + ' of ' + str(len(entry_list)) +
+                     ' uniprot entries are not in ' + c.uniprot_dat +
+                     ', they are listed in ' + c.uniprot_failures)
+      uniprot_fetcher.write_failures()
+    return text_dic
+
+  text_dic = {}
+  to_fetch = []
+  for entry in entry_list:
+    # disk cache
+    text = uniprot_disk.get(entry)
+    if text is None:
+      to_fetch.append(entry)
+    text_dic[entry] = text
+
+  if to_fetch:
+    fetched_dic = uniprot_fetcher.fetch_list(to_fetch)
+    # empty answer for obsolete entries, not worth caching
+    uniprot_disk.put_list([item for item in fetched_dic.iteritems()
+                           if item[1]])
+    text_dic.update(fetched_dic)
+
+  return text_dic
+
+
+# dictionary of the last maxsize keys used (least recently used are
+# dropped first)
+
+class LruCache(object):
+
+  def __init__(self, maxsize):
+    self.maxsize = maxsize
+    self.dic = OrderedDict()
+
+  def __contains__(self, key):
+    return key in self.dic
+
+  def __getitem__(self, key):
+    # move to the most recent end
+    value = self.dic.pop(key)
+    self.dic[key] = value
+    return value
+
+  def __setitem__(self, key, value):
+    if key in self.dic:
+      del self.dic[key]
+    elif len(self.dic) >= self.maxsize:
+      self.dic.popitem(last=False)
+    self.dic[key] = value
+
+  def clear(self):
+    self.dic.clear()
+
+
+# sqlite table of entry texts, tagged with release and fetch time
+# the database is opened on first use; with an empty file name nothing is
+# cached
+
+class UniprotDiskCache(object):
+
+  def __init__(self):
+    self.connection = None
+    self.cache_file = None
+
+  def connect(self):
+    if not c.uniprot_cache:
+      return None
+    if self.cache_file != c.uniprot_cache:
+      self.close()
+      self.connection = sqlite3.connect(c.uniprot_cache)
+      # keep str, not unicode
+      self.connection.text_factory = str
+      self.connection.execute(
+          'CREATE TABLE IF NOT EXISTS uniprot (entry TEXT PRIMARY KEY, ' +
+          'release TEXT, fetched REAL, text TEXT)')
+      self.cache_file = c.uniprot_cache
+    return self.connection
+
+  def get(self, entry):
+    connection = self.connect()
+    if connection is None:
+      return None
+    row = connection.execute(
+        'SELECT text FROM uniprot WHERE entry=? AND release=? AND ' +
+        'fetched>?', (entry, c.uniprot_release,
+                      time.time() - c.uniprot_cache_days * 86400)
+        ).fetchone()
+    if row is None:
+      return None
+    return row[0]
+
+  def put(self, entry, text):
+    self.put_list([(entry, text)])
+
+  # [(entry, text)], in one transaction
+  def put_list(self, entry_text_list):
+    connection = self.connect()
+    if connection is None or not entry_text_list:
+      return
+    fetched = time.time()
+    with connection:
+      connection.executemany(
+          'INSERT OR REPLACE INTO uniprot VALUES (?,?,?,?)',
+          [(entry, c.uniprot_release, fetched, text)
+           for entry, text in entry_text_list])
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+    self.connection = None
+    self.cache_file = None
+
+
+# caches of this run
+uniprot_memory = LruCache(c.uniprot_memory_records)
+uniprot_disk = UniprotDiskCache()
+
+
+# index of the flat file: {accession or entry name: (offset, length)} in
+# a bundle entry file (see INPUT BUNDLE), c.uniprot_dat_index, with size
+# and modification time of the flat file in c.uniprot_dat_index + '.p'
+# the index is built in one pass over the flat file, and rebuilt when the
+# flat file changes; it is never held in memory as a whole, so that it also
+# works for TrEMBL: the names are sorted in runs of
+# c.uniprot_dat_run_size, written to temporary files next to the index,
+# and the runs are merged into the index file
+
+# flat file and index opened in this run, {'file', 'map', 'index'}
+uniprot_dat_cache = {}
+
+def uniprot_dat_index(dat_file):
+  if not os.path.isfile(dat_file):
+    logger.error('The file ' + dat_file + ' cannot be found' +
+                 ' in the current directory!')
+    logger.warning('The program is aborted.')
+    sys.exit()
+  file_stat = os.stat(dat_file)
+  stamp = (dat_file, file_stat.st_size, file_stat.st_mtime)
+
+  stamp_file = c.uniprot_dat_index + '.p'
+  pickled_stamp = None
+  if os.path.isfile(stamp_file) and os.path.isfile(c.uniprot_dat_index):
+    with open(stamp_file, 'rb') as f:
+      pickled_stamp = pickle.load(f)
+
+  if pickled_stamp != stamp:
+    logger.info('We are indexing ' + dat_file + '.')
+    run_dir = tempfile.mkdtemp(dir=os.path.dirname(
+                                 os.path.abspath(c.uniprot_dat_index)))
+    try:
+      run_list = uniprot_dat_runs(dat_file, run_dir)
+      write_bundle_items(uniprot_dat_merge(run_list), c.uniprot_dat_index)
+    finally:
+      shutil.rmtree(run_dir)
+    with open(stamp_file, 'wb') as f:
+      pickle.dump(stamp, f, pickle.HIGHEST_PROTOCOL)
+
+  return stamp, MmapDic(c.uniprot_dat_index)
+
+
+# (name, offset, length) of each accession and entry name of the flat
+# file, in the order of the file
+
+def uniprot_dat_names(dat_file):
+  # name/accessions of the current record and where it starts
+  names = []
+  start = 0
+  offset = 0
+  with open(dat_file, 'rb') as f:
+    for line in f:
+      if line[0:5] == 'ID   ':
+        names.append(line[5:].split(None, 1)[0])
+      elif line[0:5] == 'AC   ':
+        names.extend(acc.strip() for acc in line[5:].split(';')
+                     if acc.strip())
+      offset = offset + len(line)
+      # end of the record
+      if line[0:2] == '//':
+        for name in names:
+          yield name, start, offset - start
+        names = []
+        start = offset
+
+
+# write the names of the flat file to run files in run_dir, each sorted
+# by name then offset, lines 'name\toffset\tlength'; return their paths
+
+def uniprot_dat_runs(dat_file, run_dir):
+  run_list = []
+  name_iter = uniprot_dat_names(dat_file)
+  while True:
+    run = list(itertools.islice(name_iter,
+                                max(1, c.uniprot_dat_run_size)))
+    if not run:
+      break
+    run.sort()
+    run_file = os.path.join(run_dir, 'run%d' % len(run_list))
+    with open(run_file, 'wb') as f:
+      for name, start, length in run:
+        f.write(name + '\t' + str(start) + '\t' + str(length) + '\n')
+    run_list.append(run_file)
+  return run_list
+
+
+# (name, offset, length) of a run file
+
+def uniprot_dat_run(run_file):
+  with open(run_file, 'rb') as f:
+    for line in f:
+      name, start, length = line.split('\t')
+      yield name, int(start), int(length)
+
+
+# (name, (offset, length)) pairs of the merged runs, sorted by name
+# the first record wins if an accession is listed twice
+
+def uniprot_dat_merge(run_list):
+  last_name = None
+  for name, start, length in heapq.merge(*[uniprot_dat_run(run_file)
+                                           for run_file in run_list]):
+    if name != last_name:
+      yield name, (start, length)
+      last_name = name
+
+
+# text of the entry in the local flat file, or None if it is not there
+
+def uniprot_dat_text(entry):
+  # open flat file and index once per run
+  if uniprot_dat_cache.get('file') != c.uniprot_dat:
+    stamp, index_dic = uniprot_dat_index(c.uniprot_dat)
+    with open(c.uniprot_dat, 'rb') as f:
+      uniprot_dat_cache['map'] = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+    uniprot_dat_cache['index'] = index_dic
+    uniprot_dat_cache['file'] = c.uniprot_dat
+
+  index_dic = uniprot_dat_cache['index']
+  if entry not in index_dic:
+    return None
+  offset, length = index_dic[entry]
+  return uniprot_dat_cache['map'][offset:offset + length]
+############################################################################
+
+
+
+
+############################################################################
+### UNIPROT_FETCHER
+############################################################################
+# fetch uniprot entries over http, c.uniprot_url % entry, several at a
+# time:
+# - c.uniprot_workers threads, each keeping its http connection open
+#   between requests (keep-alive)
+# - at most c.uniprot_rate requests per second over all threads (token
+#   bucket, 0 for no limit)
+# - connection errors, http 429 and 5xx are retried up to c.uniprot_retries
+#   times, waiting c.uniprot_backoff seconds, then twice as long each time
+# - the entries that cannot be retrieved are left out (None) and listed
+#   with the reason in c.uniprot_failures, rewritten as failures come in
+# - with c.uniprot_batch > 1, up to c.uniprot_batch entries are asked in
+#   one request, c.uniprot_batch_url % 'acc1,acc2,...', and the records
+#   are split at the '//' lines while the answer streams in; the entries
+#   missing from the answer (obsolete, secondary accessions...) are then
+#   asked one by one
+
+# status codes worth retrying
+retry_status = set([429, 500, 502, 503, 504])
+# status codes of a redirection
+redirect_status = set([301, 302, 303, 307, 308])
+
+
+# at most rate takes per second, with bursts of up to capacity
+
+class TokenBucket(object):
+
+  def __init__(self, rate, capacity):
+    self.rate = float(rate)
+    self.capacity = max(float(capacity), 1.0)
+    self.tokens = self.capacity
+    self.last = time.time()
+    self.lock = threading.Lock()
+
+  # wait for a token
+  def take(self):
+    if self.rate <= 0:
+      return
+    while True:
+      with self.lock:
+        now = time.time()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+          self.tokens = self.tokens - 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+
+class UniprotFetcher(object):
+
+  def __init__(self):
+    # connections of each thread, {(scheme, host): connection}
+    self.local = threading.local()
+    self.bucket = None
+    # failures of this run, {entry: reason}
+    self.failures = {}
+
+  def connection(self, scheme, host):
+    if not hasattr(self.local, 'connections'):
+      self.local.connections = {}
+    key = (scheme, host)
+    if key not in self.local.connections:
+      if scheme == 'https':
+        connection_class = httplib.HTTPSConnection
+      else:
+        connection_class = httplib.HTTPConnection
+      self.local.connections[key] = connection_class(
+          host, timeout=c.uniprot_timeout)
+    return self.local.connections[key]
+
+  def drop(self, scheme, host):
+    connection = self.local.connections.pop((scheme, host), None)
+    if connection is not None:
+      connection.close()
+
+  # one request, (status, result, location)
+  # the body of a 200 answer is passed to reader (eg read_response), which
+  # returns the result; other bodies are dropped
+  def request(self, url, reader):
+    parts = urlparse.urlsplit(url)
+    path = parts.path
+    if parts.query:
+      path = path + '?' + parts.query
+    connection = self.connection(parts.scheme, parts.netloc)
+    try:
+      connection.request('GET', path)
+      response = connection.getresponse()
+      result = None
+      if response.status == 200:
+        result = reader(response)
+      # read the rest, so that the connection can be used again
+      response.read()
+    except (socket.error, httplib.HTTPException):
+      # the server may have closed the connection, open a new one
+      self.drop(parts.scheme, parts.netloc)
+      raise
+    if response.getheader('connection', '').lower() == 'close':
+      self.drop(parts.scheme, parts.netloc)
+    return response.status, result, response.getheader('location')
+
+  # (result or None, last http status or None, failure reason or None),
+  # with retries
+  def retrieve(self, url, reader):
+    delay = c.uniprot_backoff
+    reason = None
+    status = None
+    redirects = 0
+    attempt = 0
+    while attempt <= c.uniprot_retries:
+      self.bucket.take()
+      try:
+        status, result, location = self.request(url, reader)
+      except (socket.error, httplib.HTTPException) as e:
+        status = None
+        reason = 'connection error (' + (str(e) or
+                                         e.__class__.__name__) + ')'
+      else:
+        if status == 200:
+          return result, status, None
+        # secondary accessions redirect to the primary entry
+        if status in redirect_status and location and redirects < 5:
+          url = urlparse.urljoin(url, location)
+          redirects = redirects + 1
+          continue
+        reason = 'http ' + str(status)
+        if status not in retry_status:
+          return None, status, reason
+      attempt = attempt + 1
+      if attempt <= c.uniprot_retries:
+        time.sleep(delay)
+        delay = delay * 2
+    return None, status, reason + ' after ' + str(attempt) + ' attempts'
+
+  # [(entry, text or None, failure reason or None)]
+  # an empty answer is an obsolete entry, not a failure
+  def fetch(self, entry):
+    text, status, reason = self.retrieve(c.uniprot_url % entry,
+                                         read_response)
+    return [(entry, text, reason)]
+
+  # same for a batch of entries, in one request
+  def fetch_batch(self, entry_batch):
+    if len(entry_batch) == 1:
+      return self.fetch(entry_batch[0])
+    text_dic, status, reason = self.retrieve(
+        c.uniprot_batch_url % ','.join(entry_batch),
+        lambda response: split_records(stream_lines(response),
+                                       entry_batch))
+    # request refused (eg one malformed accession), ask one by one
+    if (text_dic is None and status is not None and
+        status not in retry_status):
+      text_dic = {}
+    result_list = []
+    for entry in entry_batch:
+      if text_dic is None:
+        result_list.append((entry, None, reason))
+      elif entry in text_dic:
+        result_list.append((entry, text_dic[entry], None))
+      else:
+        result_list.extend(self.fetch(entry))
+    return result_list
+
+  # {entry: text or None}
+  def fetch_list(self, entry_list):
+    self.bucket = TokenBucket(c.uniprot_rate, c.uniprot_workers)
+    batch_size = max(1, c.uniprot_batch)
+    batch_list = [entry_list[i:i + batch_size] for i in
+                  range(0, len(entry_list), batch_size)]
+    workers = max(1, min(c.uniprot_workers, len(batch_list)))
+    if workers == 1:
+      batch_result_list = [self.fetch_batch(batch) for batch in batch_list]
+    else:
+      pool = ThreadPool(workers)
+      try:
+        batch_result_list = pool.map(self.fetch_batch, batch_list)
+      finally:
+        pool.close()
+        pool.join()
+    result_list = itertools.chain(*batch_result_list)
+
+    text_dic = {}
+    failed = 0
+    for entry, text, reason in result_list:
+      text_dic[entry] = text
+      if reason is not None:
+        self.failures[entry] = reason
+        failed = failed + 1
+
+    if failed:
+      logger.warning(str(failed) + ' of ' + str(len(entry_list)) +
+                     ' uniprot entries cannot be retrieved, they are' +
+                     ' listed in ' + c.uniprot_failures)
+      self.write_failures()
+    return text_dic
+
+  def write_failures(self):
+    if not c.uniprot_failures:
+      return
+    with open(c.uniprot_failures, 'w') as f:
+      for entry in sorted(self.failures):
+        f.write(entry + '\t' + self.failures[entry] + '\n')
+
+
+# whole body of an http response
+
+def read_response(response):
+  return response.read()
+
+
+# lines of a stream (eg an http response) read in blocks, without loading
+# it as a whole
+
+def stream_lines(stream, block_size=65536):
+  rest = ''
+  while True:
+    block = stream.read(block_size)
+    if not block:
+      break
+    lines = (rest + block).split('\n')
+    # last line, until its end comes in
+    rest = lines.pop()
+    for line in lines:
+      yield line + '\n'
+  if rest:
+    yield rest
+
+
+# split flat file lines into records at the '//' lines, and match them to
+# the requested entries through their ID and AC lines
+# returns {entry: text} for the entries of entry_list found
+
+def split_records(lines, entry_list):
+  wanted = set(entry_list)
+  text_dic = {}
+  record = []
+  names = []
+  for line in lines:
+    record.append(line)
+    if line[0:5] == 'ID   ':
+      names.append(line[5:].split(None, 1)[0])
+    elif line[0:5] == 'AC   ':
+      names.extend(acc.strip() for acc in line[5:].split(';')
+                   if acc.strip())
+    # end of the record
+    elif line[0:2] == '//':
+      text = ''.join(record)
+      for name in names:
+        # the first record wins if an entry is matched twice
+        if name in wanted and name not in text_dic:
+          text_dic[name] = text
+      record = []
+      names = []
+  return text_dic
+
+
+# fetcher of this run
+uniprot_fetcher = UniprotFetcher()
+############################################################################
+
+
+
+
 ############################################################################
 ### EXPASY_FILTER
 ############################################################################
@@ -741,44 +1978,30 @@ def expasy_filter(uniprot_list, filter_type):
   # counter for obsolete/http err
   obsolete = 0
 
-  for entry in uniprot_list:
-    try:
-        # get handle
-        handle = ExPASy.get_sprot_raw(entry)
-        # swissprot read
-        record = SwissProt.read(handle)
-        
-
-        # FILTER according to presence pdb structure
-        if filter_type == 'pdb':
-          #logger.debug(record.cross_references)
-          #so far the pdb does not exist
-          pdb_exists = False 
-
-          # get tuples with references (pdb, etc...)
-          cross_ref = record.cross_references
-          # loop over every tuple in the list
-          for tup in record.cross_references:
-            # if the first is pdb means there one or more pdb
-            if tup[0] == "PDB":
-              pdb_exists = True 
-
-          if pdb_exists == True:
-            # add entry to the list
-            filtered_list.append(entry)
+  # uniprot rows, from uniprot or the local flat file, all at once
+  record_dic = uniprot_table(uniprot_list)
 
+  for entry in uniprot_list:
+    record = record_dic[entry]
+    if record is None:
+      obsolete = obsolete + 1
+      #logger.debug('uh-ho')
 
-        # FILTER according to reviewed uniprot
-        elif filter_type == 'reviewed':
-          # check it is reviewed
-          if record.data_class == 'Reviewed':
-            # add reviewed entry to the list
-            filtered_list.append(entry)
+    else:
+      # FILTER according to presence pdb structure
+      if filter_type == 'pdb':
+        # pdb ids in the cross references
+        if record.pdb:
+          # add entry to the list
+          filtered_list.append(entry)
 
 
-    except HTTPError:
-      obsolete = obsolete + 1
-      #logger.debug('uh-ho')
+      # FILTER according to reviewed uniprot
+      elif filter_type == 'reviewed':
+        # check it is reviewed
+        if record.data_class == 'Reviewed':
+          # add reviewed entry to the list
+          filtered_list.append(entry)
 
 
   # logger.debug(obsolete)
@@ -799,30 +2022,26 @@ def expasy_dic(uniprot_list, filter_type):
   # dictionary
   final_dic = {}
 
+  # uniprot rows, from uniprot or the local flat file, all at once
+  record_dic = uniprot_table(uniprot_list)
+
   for entry in uniprot_list:
-    try:
-        # get handle
-        handle = ExPASy.get_sprot_raw(entry)
-        # swissprot read
-        record = SwissProt.read(handle)
-
-        # FILTER according to reviewed uniprot
-        if filter_type == 'taxa':
-          # list of uniprots matching each
-          taxa_id = record.taxonomy_id[0]
-          # if it is already there
-          if taxa_id in final_dic:
-            # add entry to list
-            final_dic[taxa_id].append(entry)
+    record = record_dic[entry]
+    if record is not None:
+      # FILTER according to reviewed uniprot
+      if filter_type == 'taxa':
+        # list of uniprots matching each
+        taxa_id = record.taxonomy_id
+        # if it is already there
+        if taxa_id in final_dic:
+          # add entry to list
+          final_dic[taxa_id].append(entry)
 
-          else:
-            entry_list = []
-            entry_list.append(entry)
-            # add entry (as a list) to dic
-            final_dic[taxa_id] = entry_list
-          
-    except HTTPError:
-      pass
+        else:
+          entry_list = []
+          entry_list.append(entry)
+          # add entry (as a list) to dic
+          final_dic[taxa_id] = entry_list
   
   return final_dic
 
@@ -872,176 +2091,220 @@ def flatten_dic(dic, keys_or_val):
 
 
 ############################################################################
-### CHEMBL_REPO
+### JOIN_MAP
 ############################################################################
-# make big map for chembl ids, for both cath and pfam arch
+# join a drug dictionary {drug: [list of uniprot]} with edge tables into
+# the big map of a dataset, for any dataset (chembl, drugbank...)
 # format {drug1:{drug_target1:{arch1:[list os schisto uniprot], arch2:[..]},
 #                 drug_target2:{..}, drug2:{........}}}
+# each table is a list of dictionaries {key: [list of values]}, the values
+# of a key are those of all its dictionaries one after the other (eg cath
+# then pfam architectures of a target); only the complete paths are kept
+# the paths below each key are worked out once, however many drugs share
+# it, so the cost is linear in the number of edges (plus the map itself)
+
+class EdgeJoin(object):
+
+  # table_list eg [[cath_dic, pfam_dic], [schisto_cath_dic, schisto_pfam_dic]]
+  def __init__(self, table_list):
+    self.table_list = table_list
+    # for each table, {key: [values of all its dictionaries]}
+    self.joined_list = [{} for table in table_list]
+    # for each table, {key: [(keys of the path below, last values)]}
+    self.path_list = [{} for table in table_list]
+
+  def joined(self, level, key):
+    joined_dic = self.joined_list[level]
+    if key not in joined_dic:
+      values = []
+      for dic in self.table_list[level]:
+        if key in dic:
+          values.extend(dic[key])
+      joined_dic[key] = values
+    return joined_dic[key]
+
+  def paths(self, level, key):
+    path_dic = self.path_list[level]
+    if key not in path_dic:
+      values = self.joined(level, key)
+      # last table, the values end the path
+      if level == len(self.table_list) - 1:
+        if values:
+          path_dic[key] = [((), values)]
+        else:
+          path_dic[key] = []
+      else:
+        path_list = []
+        for value in values:
+          for path, last_values in self.paths(level + 1, value):
+            path_list.append(((value,) + path, last_values))
+        path_dic[key] = path_list
+    return path_dic[key]
+
+  # AutoVivification {drug: {key of table 1: {...: [last values]}}}, or
+  # {drug: {key of table 1: [values]}} for one table
+  def join(self, drug_dic):
+    join_map = AutoVivification()
+    # the map has no reference cycles, do not let the garbage collector
+    # go through it again and again while it grows
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+      for drug in drug_dic:
+        for target in drug_dic[drug]:
+          for path, last_values in self.paths(0, target):
+            # own copy of the list for each path
+            if not path:
+              # one table only, the values end the path at the target
+              join_map[drug][target] = list(last_values)
+              continue
+            node = join_map[drug][target]
+            for key in path[:-1]:
+              node = node[key]
+            node[path[-1]] = list(last_values)
+    finally:
+      if gc_enabled:
+        gc.enable()
+    return join_map
 
-# takes chembl to uniprot dic, uniprot to cath dic, cath to schisto dic,
-# uniprot to pfam dic, pfam to schisto dic
-
-def chembl_repo(chembl_dic, cath_dic, schisto_cath_dic,
-                    pfam_dic, schisto_pfam_dic):
-
-  # autovivification nested dictionary
-  chembl_repo_map = AutoVivification()
-
-  # loop over each drug in the dictionary
-  for drug in chembl_dic:
-
-    # dictionary for each drug
-    each_drug_dic = {}
-
-    # sanity check the uniprot list is not empty (it should not be empty)
-    if chembl_dic[drug]:
-      # loop on list of uniprot
-      for target in chembl_dic[drug]:
-
-        # make list in which to store the cath/pfam
-        cath_pfam = []
-
-        # append cath value, only if it exists in the dictionary
-        if target in cath_dic:
-          cath_pfam.extend(cath_dic[target])
-
-        # append pfam value, only if it exists in the dictionary
-        if target in pfam_dic:
-          cath_pfam.extend(pfam_dic[target])
-
-        #logger.debug(cath_pfam)
-        # check the list is not empy
-        if cath_pfam:
-        # make dictionary
-          each_drug_dic[target] = cath_pfam
-
-      # finished loops for all targets, we have the dictionary
-      # with {uniprot1:[list of arch],uniprot2:[list]}
-      #logger.debug(each_drug_dic)
-
-      #loop over each uniprot in new dictionary
-      for targ in each_drug_dic:
-
-        # dictionary for each target
-        each_target_dic = {}
-        # sanity check the arch list is not empty:
-        if each_drug_dic[targ]:
-          # loop over list of architectures
-          for arch in each_drug_dic[targ]:
-            # empty list for schisto
-            schisto_list = []
-            # check it exists in the cath dictionary
-            if arch in schisto_cath_dic:
-              schisto_list.extend(schisto_cath_dic[arch])
-
-            if arch in schisto_pfam_dic:
-              schisto_list.extend(schisto_pfam_dic[arch])
-
-
-
-            # check list is not empty
-            if schisto_list:
-              #logger.debug(schisto_list)
-              # add list as values in dictionary
-              each_target_dic[arch] = schisto_list
-
-              #logger.debug(each_target_dic)
-
-
-              chembl_repo_map[drug][targ][arch] = each_target_dic[arch]
 
+# big map of a dataset: takes drug to uniprot dic (chembl_dic,
+# drugbank_dic...), uniprot to cath dic, cath to schisto dic, uniprot to
+# pfam dic, pfam to schisto dic
 
-  return chembl_repo_map
+def dataset_repo(drug_dic, cath_dic, schisto_cath_dic,
+                 pfam_dic, schisto_pfam_dic):
+  return EdgeJoin([[cath_dic, pfam_dic],
+                   [schisto_cath_dic, schisto_pfam_dic]]).join(drug_dic)
 ############################################################################
 
 
 
 
 ############################################################################
-### DRUGBANK_REPO
+### SPARSE_GRAPH
 ############################################################################
-# make big map for drugbank ids, for both cath and pfam arch
-# format {drug1:{drug_target1:{arch1:[list os schisto uniprot], arch2:[..]},
-#                 drug_target2:{..}, drug2:{........}}}
+# the drug - target - architecture - species protein graph of a dataset as
+# sparse matrices (scipy.sparse, only needed with c.sparse_graph = True):
+# every drug, target, architecture and protein gets an integer index, and
+# the edges are three csr matrices, drug x target, target x architecture
+# (cath then pfam) and architecture x protein (cath then pfam)
+# their product is drug x protein, the number of paths from each drug to
+# each protein, so that reachability and counts (rankings of drugs and
+# proteins) come from the matrices instead of walking the big map
+# the drugs and proteins reached are those of the big map of the same
+# dictionaries (dataset_repo)
 
-# takes chembl to uniprot dic, uniprot to cath dic, cath to schisto dic,
-# uniprot to pfam dic, pfam to schisto dic
+class DrugGraph(object):
 
-def drugbank_repo(drugbank_dic, cath_dic, schisto_cath_dic,
-                    pfam_dic, schisto_pfam_dic):
+  def __init__(self, drug_dic, cath_dic, schisto_cath_dic,
+               pfam_dic, schisto_pfam_dic):
+    try:
+      from scipy import sparse
+    except ImportError:
+      logger.error('The python module scipy is needed for sparse_graph' +
+                   ' = True (see config.py)!')
+      logger.warning('The program is aborted.')
+      sys.exit()
 
-  # autovivification nested dictionary
-  drugbank_repo_map = AutoVivification()
+    self.drug_list = sorted(drug_dic)
+    drug_index = dict((drug, i) for i, drug in enumerate(self.drug_list))
+    self.target_list = []
+    target_index = {}
+    self.arch_list = []
+    arch_index = {}
+    self.protein_list = []
+    protein_index = {}
 
-  #below copied from chembl_repo_map
+    drug_target = edge_matrix(sparse, [drug_dic], drug_index,
+                              self.target_list, target_index)
+    target_arch = edge_matrix(sparse, [cath_dic, pfam_dic], target_index,
+                              self.arch_list, arch_index)
+    arch_protein = edge_matrix(sparse, [schisto_cath_dic, schisto_pfam_dic],
+                               arch_index, self.protein_list,
+                               protein_index)
+    # drug x protein, number of paths
+    self.reach = (drug_target * target_arch * arch_protein).tocsr()
+    self.reach.eliminate_zeros()
 
-  # loop over each drug in the dictionary
-  for drug in drugbank_dic:
+  # number of proteins reached by each drug, {drug: count}, only the drugs
+  # reaching at least one
+  def drug_counts(self):
+    return count_dic(self.drug_list, self.reach.getnnz(axis=1))
 
-    # dictionary for each drug
-    each_drug_dic = {}
+  # number of drugs reaching each protein, {protein: count}
+  def protein_counts(self):
+    return count_dic(self.protein_list, self.reach.getnnz(axis=0))
 
-    # sanity check the uniprot list is not empty (it should not be empty)
-    if drugbank_dic[drug]:
-      # loop on list of uniprot
-      for target in drugbank_dic[drug]:
+  # drugs reaching at least one protein, sorted (as flatten_dic 'keys' of
+  # the big map)
+  def reached_drugs(self):
+    return sorted(self.drug_counts())
 
-        # make list in which to store the cath/pfam
-        cath_pfam = []
+  # proteins reached by at least one drug, sorted (as flatten_dic
+  # 'values_4' of the big map)
+  def reached_proteins(self):
+    return sorted(self.protein_counts())
 
-        # append cath value, only if it exists in the dictionary
-        if target in cath_dic:
-          cath_pfam.extend(cath_dic[target])
 
-        # append pfam value, only if it exists in the dictionary
-        if target in pfam_dic:
-          cath_pfam.extend(pfam_dic[target])
+# csr matrix of the edges {row key: [column keys]} of the dictionaries in
+# dic_list, rows given by row_index; new column keys are added to
+# col_list and col_index as they come, so that they are complete for the
+# next matrix (its rows)
 
-        #logger.debug(cath_pfam)
-        # check the list is not empy
-        if cath_pfam:
-        # make dictionary
-          each_drug_dic[target] = cath_pfam
+def edge_matrix(sparse, dic_list, row_index, col_list, col_index):
+  row_list = []
+  column_list = []
+  for dic in dic_list:
+    for key in dic:
+      if key not in row_index:
+        continue
+      row = row_index[key]
+      for value in dic[key]:
+        if value not in col_index:
+          col_index[value] = len(col_list)
+          col_list.append(value)
+        row_list.append(row)
+        column_list.append(col_index[value])
+  # repeated edges add up
+  return sparse.csr_matrix(([1] * len(row_list), (row_list, column_list)),
+                           shape=(len(row_index), len(col_list)),
+                           dtype='int64')
 
-      # finished loops for all targets, we have the dictionary
-      # with {uniprot1:[list of arch],uniprot2:[list]}
-      #logger.debug(each_drug_dic)
 
-      #loop over each uniprot in new dictionary
-      for targ in each_drug_dic:
+# {key: count} of the non-zero counts
 
-        # dictionary for each target
-        each_target_dic = {}
-        # sanity check the arch list is not empty:
-        if each_drug_dic[targ]:
-          # loop over list of architectures
-          for arch in each_drug_dic[targ]:
-            # empty list for schisto
-            schisto_list = []
-            # check it exists in the cath dictionary
-            if arch in schisto_cath_dic:
-              schisto_list.extend(schisto_cath_dic[arch])
+def count_dic(key_list, count_array):
+  return dict((key_list[i], int(count)) for i, count in
+              enumerate(count_array) if count)
 
-            if arch in schisto_pfam_dic:
-              schisto_list.extend(schisto_pfam_dic[arch])
 
-            # check list is not empty
-            if schisto_list:
-              #logger.debug(schisto_list)
-              # add list as values in dictionary
-              each_target_dic[arch] = schisto_list
+# list of (key, count), the highest counts first (ties by key)
+
+def count_ranking(count_dic):
+  return sorted(count_dic.items(), key=lambda item: (-item[1], item[0]))
 
-              #logger.debug(each_target_dic)
 
-              drugbank_repo_map[drug][targ][arch] = each_target_dic[arch]
+# write the drugs of a dataset ranked by the number of species proteins
+# they reach to c.drug_ranking % dataset (drug, proteins), and log the
+# first c.sparse_top
 
-  #logger.debug(drugbank_repo_map)
-  return drugbank_repo_map
+def drug_ranking(dataset, graph):
+  ranking = count_ranking(graph.drug_counts())
+  file_name = c.drug_ranking % dataset
+  with open(file_name, 'w') as f:
+    for drug, count in ranking:
+      f.write(drug + '\t' + str(count) + '\n')
+  logger.info('The ' + dataset + ' drugs reaching the most proteins' +
+              ' (all of them in ' + file_name + '): ' +
+              ', '.join(drug + ' (' + str(count) + ')' for drug, count in
+                        ranking[:c.sparse_top]))
 ############################################################################
 
 
 
 
+
 ############################################################################
 ### FILT_SCHISTO_MAP
 ############################################################################
@@ -1082,18 +2345,21 @@ def filt_schisto_map(chembl_repo_map, schisto_filt):
 # values as keys and ';'-separated values as list
 
 def csv_to_dic(csv_file):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('csv_to_dic', (csv_file,))
+  if bundled is not None:
+    return bundled
+
 
 
   # empty dictionary
   csv_dic = {}
 
-  # open and read drug_bank input and count number
-  lines = file_to_lines(csv_file)
+  # stream the lines after the header
+  lines = LineSource(csv_file, has_header=True)
 
   # read csv lines with the csv reader - deals with quotation marks etc..
   incsv = csv.reader(lines)
-  # skip the first line with the headers
-  next(incsv)
 
   # loop over each line
   for line in incsv:
@@ -1123,6 +2389,11 @@ def csv_to_dic(csv_file):
 # it works but better ADD WRAPPER TO PROPERLY SKIP THE COMMENT LINE!
 
 def csv_to_lst(csv_file):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('csv_to_lst', (csv_file,))
+  if bundled is not None:
+    return bundled
+
   # regular expression for string containing at least one '#'
   #contains_comment = re.compile('#.*')
 
@@ -1139,7 +2410,7 @@ def csv_to_lst(csv_file):
   # logger.debug(comment_count)
 
 
-  with open(csv_file) as f:
+  with open_input(csv_file) as f:
 
     #,quoting=csv.QUOTE_MINIMAL
     # get rows with csv reader
@@ -1214,13 +2485,17 @@ def list_second_level_dic(dictionary):
 # read lst file and creat dictionary with first column as key and rest as list
 
 def lst_dic(lst_file):
-  lines = file_to_lines(lst_file)
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('lst_dic', (lst_file,))
+  if bundled is not None:
+    return bundled
+
   lst_dictionary = {}
   # iterate over lines
-  for i in range(0,len(lines)):
+  for line in LineSource(lst_file):
     #logger.debug(line)
     # split tab
-    splitline = lines[i].split(":")
+    splitline = line.split(":")
     #logger.debug(splitline)
     
     # empty list for the het groups
@@ -1291,23 +2566,16 @@ def exclude_values_from_dic(dictionary, filt_list, flag):
 # vs header 2
 
 def txt_to_dic(input_file, header1, header2):
-  # open chembldrugs.txt for reading
-  lines = file_to_lines(input_file)
-  # get the headers
-  headers = lines[0]
-  # logger.debug(headers)
-
-  # empty dic
-  dic = {}
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('txt_to_dic', (input_file, header1, header2))
+  if bundled is not None:
+    return bundled
 
-  # number of header 1 nad 2
-  h1 = header_count(headers, "\t", header1)
-  h2 = header_count(headers, "\t", header2)
+  # read the two columns, splitting each row once
+  columns = txt_to_columns(input_file, "\t", [header1, header2])
 
   # populate dictionary
-  for i in range(1,len(lines)):
-    dic[lines[i].split("\t")[h1]] =  lines[i].split("\t")[h2].rstrip('\r\n')
-  
+  dic = dict(izip(columns[header1], columns[header2]))
 
   return dic
 ############################################################################
@@ -1322,21 +2590,29 @@ def txt_to_dic(input_file, header1, header2):
 # (column number n1) vs header 2 (column number n2)
 
 def smi_to_dic(input_file, n1, n2):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('smi_to_dic', (input_file, n1, n2))
+  if bundled is not None:
+    return bundled
+
   # open for reading
-  lines = file_to_lines(input_file)
-  #logger.debug(lines[18482])
+  lines = LineSource(input_file)
 
   # empty dic
   dic = {}
+  # number of items in the first row of the file
+  first_count = None
 
   # populate dictionary
-  for i in range(0,len(lines)):
+  for line in lines:
     # check line is not empty string
-    split = lines[i].rstrip('\r\n').split("\t")
+    split = line.rstrip('\r\n').split("\t")
+    if first_count is None:
+      first_count = len(line.split("\t"))
     
     # check the number of items is the same as the number of items in the
     # first row of the file
-    if len(split) == len(lines[0].split("\t")): 
+    if len(split) == first_count: 
     #or len(split) == (len(lines[0].split("\t"))-1):
 
       if split[n1].rstrip('\r\n') != '' and split[n2].rstrip('\r\n') != '':
@@ -1344,7 +2620,7 @@ def smi_to_dic(input_file, n1, n2):
         dic[split[n1]] =  split[n2]
 
   # lenght total file (nb there are new lines!)      
-  # logger.debug(len(lines))
+  # logger.debug(lines.line_number)
   # # lenght dictionary created
   # logger.debug(len(dic))
 
@@ -1405,31 +2681,148 @@ def babel_smi_to_sdf(input_file, output_file):
 
 
 
+############################################################################
+### ITER_SDF
+############################################################################
+# streaming sdf parser, one forward pass over the file, one record at a time
+# yields (id, smiles, fields) for each '$$$$' block, where id and smiles are
+# the values of the id_tag and smiles_tag data items (None if absent) and
+# fields is the dictionary {tag: value} of all the data items of the record
+# use_mmap=True maps the file in memory and slices the data items straight
+# out of the map, instead of going through the lines (not for compressed
+# files, that are streamed anyway)
+
+# regex for the header line of a data item, eg '> <DATABASE_ID>'
+sdf_tag = re.compile(r'^>.*?<([^>]+)>')
+
+# regex for a whole data item in the mapped file: header line, then the
+# value lines up to the first blank line
+sdf_item = re.compile(r'^>[^\n]*?<([^>\n]+)>[^\n]*\n((?:[^\r\n]+\r?\n)*)',
+                      re.MULTILINE)
+
+def iter_sdf(sdf_file, id_tag, smiles_tag, use_mmap=False):
+  # compressed files cannot be mapped, they are always streamed
+  if use_mmap and compressed_format(sdf_file) is None:
+    records = sdf_mmap_records(sdf_file)
+  else:
+    records = sdf_stream_records(sdf_file)
+
+  for fields in records:
+    yield fields.get(id_tag), fields.get(smiles_tag), fields
+
+
+# line by line version, yields dictionary {tag: value} for each record
+
+def sdf_stream_records(sdf_file):
+  input_handle = open_input(sdf_file)
+
+  fields = {}
+  # data items only come after the molfile block ('M  END')
+  in_data = False
+  # tag of the data item being read, and its value lines
+  tag = None
+  value_lines = []
+
+  for line in input_handle:
+    line = line.rstrip('\r\n')
+
+    # end of record
+    if line == '$$$$':
+      if tag is not None:
+        fields[tag] = '\n'.join(value_lines)
+      yield fields
+      fields = {}
+      in_data = False
+      tag = None
+      value_lines = []
+
+    # inside a data item, a blank line closes it
+    elif tag is not None:
+      if line == '':
+        fields[tag] = '\n'.join(value_lines)
+        tag = None
+        value_lines = []
+      else:
+        value_lines.append(line)
+
+    elif in_data:
+      match = sdf_tag.match(line)
+      if match:
+        tag = match.group(1)
+
+    elif line.startswith('M  END'):
+      in_data = True
+
+  input_handle.close()
+
+  # last record without the final '$$$$'
+  if tag is not None:
+    fields[tag] = '\n'.join(value_lines)
+  if fields:
+    yield fields
+
+
+# mmap version, yields dictionary {tag: value} for each record
+
+def sdf_mmap_records(sdf_file):
+  input_handle = open_input(sdf_file)
+
+  # an empty file cannot be mapped
+  if os.fstat(input_handle.fileno()).st_size == 0:
+    input_handle.close()
+    return
+
+  sdf_map = mmap.mmap(input_handle.fileno(), 0, access=mmap.ACCESS_READ)
+  size = len(sdf_map)
+  start = 0
+
+  while start < size:
+    # end of the record
+    end = sdf_map.find('$$$$', start)
+    if end == -1:
+      end = size
+
+    # data items only come after the molfile block
+    data_start = sdf_map.find('M  END', start, end)
+    if data_start == -1:
+      data_start = start
+
+    fields = {}
+    for match in sdf_item.finditer(sdf_map, data_start, end):
+      fields[match.group(1)] = match.group(2).replace('\r', '').rstrip('\n')
+
+    if fields:
+      yield fields
+
+    # skip '$$$$' and its line ending
+    start = sdf_map.find('\n', end)
+    if start == -1:
+      break
+    start = start + 1
+
+  sdf_map.close()
+  input_handle.close()
+############################################################################
+
+
+
+
 ############################################################################
 ### SDF_TO_DIC
 ############################################################################
-# take sdf file and convert in dictionary with key versus value
+# take sdf file and convert in dictionary with key versus value (sdf tags,
+# eg 'DATABASE_ID' and 'SMILES')
 # nb key has to be unique (eg drugbank identifier), 
 # otherwise will be overwritten
 
-def sdf_to_dic(sdf_file, key, value):
-  with open(sdf_file) as f:
-    line_count = 0
-    # empty dic
-    dic_from_sdf = {}
+def sdf_to_dic(sdf_file, key, value, use_mmap=False):
+  # empty dic
+  dic_from_sdf = {}
 
-    for line in f:
-      line_count = line_count + 1
-      if key in line:
-        db_id = linecache.getline(sdf_file, (line_count+1))
-        # strip newline
-        db_id = db_id.rstrip('\n')
-
-      if value in line:
-        smi_id = linecache.getline(sdf_file, (line_count+1))
-        # strip newline
-        smi_id = smi_id.rstrip('\n')
-        dic_from_sdf[db_id] = smi_id
+  for db_id, smi_id, fields in iter_sdf(sdf_file, key, value, use_mmap):
+    # only records that have both
+    if db_id is not None and smi_id is not None:
+      dic_from_sdf[db_id] = smi_id
 
   #logger.info(len(dic_from_sdf))
 
@@ -1777,28 +3170,28 @@ def mv_file(origin, filename, new_name):
 
 def filter_txt(input_file, output_file, header_name, filt_list):
   # open chembldrugs.txt for reading
-  lines = file_to_lines(input_file)
+  lines = LineSource(input_file, has_header=True)
 
   # get the headers
-  headers = lines[0]
+  headers = lines.header
   # find header name
-  col_header = header_count(headers, "\t", header_name)
+  schema = Schema(lines, "\t", [header_name])
+  # set of values to keep, membership test is constant time
+  filt_set = set(filt_list)
 
   out = open(output_file, 'w')
   out.write(headers)
   #out.write('\n')
-  for i in range(1,len(lines)):
-    rowsplit = lines[i].split("\t")
-
+  for line in lines:
     # get the chembl drug and target id values for the row
-    col = rowsplit[col_header]
+    col = schema.fields(schema.split(line))[0]
 
     # only proceed if the target id is not an empty field!
     if col  != "":
 
       # check if the molecule chembl id is one of the drugs we want
-      if col in filt_list:
-        out.write(lines[i])
+      if col in filt_set:
+        out.write(line)
         #out.write('\n')
 
   # close output file
@@ -1866,27 +3259,26 @@ def uniprot_to_fasta(uniprot_list):
 
   logger.info(file_name)
   
+  # uniprot rows, from uniprot or the local flat file, all at once
+  record_dic = uniprot_table(uniprot_list)
+
   with open(str(file_name), 'w') as f:
     # for uniprot in uniprot_list:
     for entry in uniprot_list:
-      try:
-          # get handle
-          handle = ExPASy.get_sprot_raw(entry)
-          # swissprot read
-          record = SwissProt.read(handle)
-
-          # list of uniprots matching each
-          seq = record.sequence
-          # add first line
-          f.write('>' + entry + '\n')
-          # add sequence
-          f.write(seq + '\n')
-          #logger.info(seq)
-            
-      except HTTPError:
-        logger.error('We cannot access ExPASy!')
-        logger.warning('We are exiting the program.')
-        sys.exit()
+      record = record_dic[entry]
+      # skip the entries that cannot be retrieved (see UNIPROT_FETCHER)
+      if record is None:
+        logger.warning('The uniprot entry ' + entry + ' cannot be' +
+                       ' retrieved, it is left out of ' + file_name)
+        continue
+
+      # list of uniprots matching each
+      seq = record.sequence
+      # add first line
+      f.write('>' + entry + '\n')
+      # add sequence
+      f.write(seq + '\n')
+      #logger.info(seq)
 
   # simply return the file name
   return file_name
@@ -1978,8 +3370,11 @@ def run_or_pickle(function_return_obj, function_name, arg1 = None,
     else:
       function_return_obj = function_name(arg1, arg2, arg3, arg4, arg5)
 
-    # dump result in pickle
-    pickle.dump(function_return_obj, open(pickle_name, "wb"))
+    # dump result in pickle, unless the loader has read it from a fresh
+    # bundle entry (see INPUT BUNDLE)
+    args = [arg for arg in (arg1, arg2, arg3, arg4, arg5) if arg != None]
+    if bundle_file(getattr(function_name, '__name__', ''), args) is None:
+      pickle.dump(function_return_obj, open(pickle_name, "wb"))
 
   # return what the function returned or the pickle
   return function_return_obj
@@ -1989,42 +3384,466 @@ def run_or_pickle(function_return_obj, function_name, arg1 = None,
 
 
 
+############################################################################
+### PARALLEL_LOAD
+############################################################################
+# parse independent input files at the same time, in a pool of
+# c.load_workers processes, ahead of the run_or_pickle calls that read them
+# takes list of (pickle name, function, tuple of arguments), with the same
+# pickle name, function and arguments as the run_or_pickle call
+# each worker dumps the pickle run_or_pickle would write (binary protocol)
+# and sends nothing back, the main process only loads a pickle when its
+# run_or_pickle call comes, so a step that is not run never loads its files
+# jobs that already have a pickle or a fresh bundle entry (see INPUT
+# BUNDLE) are not run; with one worker or processor nothing is run ahead,
+# run_or_pickle parses each file when it is needed
+# the first argument of each function is its input file, checked before
+# the pool starts; a loader that aborts anyway (sys.exit on a corrupt
+# file) is reported back to the main process, which aborts after it
+
+def run_load_job(job):
+  # runs in the worker process
+  pickle_name, function_name, args = job
+  try:
+    returned = function_name(*args)
+  except SystemExit:
+    # the loader has logged why, a worker that exits would leave the pool
+    # waiting forever
+    return None
+  # dump result in pickle
+  with open(pickle_name + ".p", "wb") as f:
+    pickle.dump(returned, f, pickle.HIGHEST_PROTOCOL)
+  return pickle_name
+
+def parallel_load(job_list):
+  # jobs that do not have a pickle or a bundle entry yet
+  to_run = []
+  for job in job_list:
+    pickle_name, function_name, args = job
+    if os.path.isfile(pickle_name + ".p"):
+      continue
+    if bundle_file(function_name.__name__, args) is None:
+      to_run.append(job)
+
+  # check the input files before starting the workers
+  for pickle_name, function_name, args in to_run:
+    if not os.path.isfile(args[0]):
+      logger.error('The file ' + args[0] + ' cannot be found' +
+                   ' in the current directory!')
+      logger.warning('The program is aborted.')
+      sys.exit()
+
+  # no more workers than jobs or processors
+  workers = min(c.load_workers, len(to_run), multiprocessing.cpu_count())
+
+  # no gain from a pool for one job or processor
+  if workers <= 1:
+    return
+
+  pool = multiprocessing.Pool(workers)
+  try:
+    # with a timeout, so that a worker killed from outside does not
+    # leave us waiting forever
+    done_list = pool.map_async(run_load_job, to_run,
+                               chunksize=1).get(c.load_timeout)
+  except multiprocessing.TimeoutError:
+    logger.error('The input files have not been loaded after ' +
+                 str(c.load_timeout) + ' seconds!')
+    logger.warning('The program is aborted.')
+    pool.terminate()
+    sys.exit()
+  finally:
+    pool.close()
+    pool.join()
+
+  for job, done in izip(to_run, done_list):
+    if done is None:
+      logger.error('We cannot load ' + job[0] + ' (see above)!')
+      logger.warning('The program is aborted.')
+      sys.exit()
+############################################################################
+
+
+
+
+############################################################################
+### INPUT BUNDLE
+############################################################################
+# compiled input bundle: the dictionaries/lists returned by the loaders
+# (lst_dic, csv_to_dic, smi_to_dic, txt_to_dic, ...) are written once, by
+# running 'python drug_repo.py compile-inputs', to files in c.bundle_dir,
+# one marshalled object per loader call, and read back with a single
+# marshal.loads instead of parsing the text again
+# run_or_pickle does not pickle what a loader read from a fresh bundle
+# entry, the entry is already the faster copy, and parallel_load does not
+# parse it ahead
+# the manifest records md5 checksum, size and modification time of each
+# source file, an entry is only used while its source file is unchanged
+
+# version of the bundle files, older manifests are ignored
+bundle_format = 2
+
+# binary dictionary file (write_bundle_items, MmapDic), for the indexes that
+# are looked up key by key without being loaded (eg uniprot_dat_index)
+# layout ('<' little endian):
+# 'DRB1', number of keys (I), then one (offset Q, key length I,
+# value length I) record per key, sorted by key, then keys and marshalled
+# values back to back
+bundle_magic = 'DRB1'
+bundle_head = struct.Struct('<4sI')
+bundle_rec = struct.Struct('<QII')
+
+# the manifest, loaded once per run
+bundle_manifest_cache = {}
+
+# loaders that read their result from the bundle (bundle_load)
+bundle_loaders = set(['txt_to_columns', 'swap_dic', 'txt_to_dic',
+                      'csv_to_dic', 'csv_to_lst', 'lst_dic', 'smi_to_dic',
+                      'species_index'])
+
+
+# read-only dictionary over an mmapped bundle entry file, values are
+# unmarshalled on access and keys are found by binary search
+
+class MmapDic(DictMixin, object):
+  """Read-only mapping backed by a memory-mapped bundle entry file."""
+  def __init__(self, file_name):
+    self.file_name = file_name
+    self.handle = open(file_name, 'rb')
+    self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.size = bundle_head.unpack_from(self.map, 0)
+    if magic != bundle_magic:
+      raise ValueError('Not a bundle file: ' + file_name)
+
+  def record(self, i):
+    # (offset, key length, value length) of the i-th key
+    return bundle_rec.unpack_from(self.map,
+                                  bundle_head.size + i * bundle_rec.size)
+
+  def key(self, i):
+    offset, key_len, val_len = self.record(i)
+    return self.map[offset:offset + key_len]
+
+  def find(self, key):
+    # binary search, return position of the key or -1
+    low = 0
+    high = self.size
+    while low < high:
+      mid = (low + high) // 2
+      if self.key(mid) < key:
+        low = mid + 1
+      else:
+        high = mid
+    if low < self.size and self.key(low) == key:
+      return low
+    return -1
+
+  def __getitem__(self, key):
+    i = self.find(key)
+    if i == -1:
+      raise KeyError(key)
+    offset, key_len, val_len = self.record(i)
+    return marshal.loads(self.map[offset + key_len:
+                                  offset + key_len + val_len])
+
+  def __contains__(self, key):
+    return self.find(key) != -1
+
+  def __iter__(self):
+    for i in xrange(self.size):
+      yield self.key(i)
+
+  def __len__(self):
+    return self.size
+
+  def keys(self):
+    return list(self)
+
+  def __reduce__(self):
+    # pickled (eg by run_or_pickle) as a plain dictionary
+    return (dict, (dict(self.iteritems()),))
+
+
+# write (key, value) pairs, sorted by key and without repeated keys, to
+# bundle entry file, without holding them in memory: the records go to one
+# temporary file and the keys and values to another, joined when the number
+# of keys (where the keys start) is known
+
+def write_bundle_items(item_iter, file_name):
+  temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(
+                                                    file_name)))
+  try:
+    rec_name = os.path.join(temp_dir, 'records')
+    data_name = os.path.join(temp_dir, 'data')
+    size = 0
+    # offset from the start of the keys and values
+    offset = 0
+    with open(rec_name, 'wb') as rec_file:
+      with open(data_name, 'wb') as data_file:
+        for key, value in item_iter:
+          value = marshal.dumps(value, 2)
+          rec_file.write(bundle_rec.pack(offset, len(key), len(value)))
+          data_file.write(key)
+          data_file.write(value)
+          offset = offset + len(key) + len(value)
+          size = size + 1
+
+    start = bundle_head.size + size * bundle_rec.size
+    with open(file_name, 'wb') as f:
+      f.write(bundle_head.pack(bundle_magic, size))
+      with open(rec_name, 'rb') as rec_file:
+        # records in blocks, offsets moved to the start of the keys
+        block_size = bundle_rec.size * 4096
+        for block in iter(lambda: rec_file.read(block_size), ''):
+          for i in xrange(0, len(block), bundle_rec.size):
+            offset, key_len, val_len = bundle_rec.unpack_from(block, i)
+            f.write(bundle_rec.pack(start + offset, key_len, val_len))
+      with open(data_name, 'rb') as data_file:
+        shutil.copyfileobj(data_file, f, 1048576)
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+# md5 checksum of a file, read in blocks
+
+def file_checksum(file_name):
+  md5 = hashlib.md5()
+  with open(file_name, 'rb') as f:
+    for block in iter(lambda: f.read(1048576), ''):
+      md5.update(block)
+  return md5.hexdigest()
+
+
+# (size, modification time, md5) of a source file, md5 is only recomputed
+# if size or time differ from the ones in old_stamp
+
+def file_stamp(file_name, old_stamp=None):
+  file_stat = os.stat(file_name)
+  if (old_stamp is not None and
+      old_stamp[0:2] == (file_stat.st_size, file_stat.st_mtime)):
+    return old_stamp
+  return (file_stat.st_size, file_stat.st_mtime, file_checksum(file_name))
+
+
+# entry name and file name for a loader call
+
+def bundle_entry(loader_name, args):
+  entry = loader_name + repr(tuple(args))
+  file_name = os.path.join(c.bundle_dir,
+                 loader_name + '_' + hashlib.md5(entry).hexdigest() + '.drb')
+  return entry, file_name
+
+
+def bundle_manifest():
+  manifest_name = os.path.join(c.bundle_dir, 'manifest.p')
+  if manifest_name not in bundle_manifest_cache:
+    manifest = {}
+    if os.path.isfile(manifest_name):
+      with open(manifest_name, 'rb') as f:
+        manifest = pickle.load(f)
+      # marshal format is specific to the python version
+      if (manifest.get('python') != sys.version_info[:2] or
+          manifest.get('format') != bundle_format):
+        manifest = {}
+    bundle_manifest_cache[manifest_name] = manifest
+  return bundle_manifest_cache[manifest_name]
+
+
+# return bundle entry file of loader_name(*args) if the bundle is fresh,
+# None otherwise; the first argument is the source file
+
+def bundle_file(loader_name, args):
+  if not c.use_bundle or loader_name not in bundle_loaders:
+    return None
+
+  entry, file_name = bundle_entry(loader_name, args)
+  manifest = bundle_manifest()
+  if entry not in manifest or not os.path.isfile(file_name):
+    return None
+
+  source, old_stamp = manifest[entry]
+  if not os.path.isfile(source):
+    return None
+  # check the source file has not changed
+  if file_stamp(source, old_stamp)[2] != old_stamp[2]:
+    logger.debug('The bundle entry for ' + source + ' is out of date.')
+    return None
+  return file_name
+
+
+# return bundled result of loader_name(*args) if the bundle is fresh,
+# None otherwise
+
+def bundle_load(loader_name, args):
+  file_name = bundle_file(loader_name, args)
+  if file_name is None:
+    return None
+
+  # whole object
+  with open(file_name, 'rb') as f:
+    return marshal.loads(f.read())
+############################################################################
+
+
+
+
+############################################################################
+### COMPILE_INPUTS
+############################################################################
+# compile-inputs mode: run the loaders on the input files named in config.py
+# and write their results to the bundle (c.bundle_dir)
+
+def compile_inputs():
+  logger.info('We are compiling the input files into ' + c.bundle_dir + '.')
+
+  if not os.path.isdir(c.bundle_dir):
+    os.makedirs(c.bundle_dir)
+
+  # (loader name, loader, args), the first argument is the source file
+  bundle_jobs = [
+    ('txt_to_columns', txt_to_columns,
+      (c.chembl_input, "\t", chembl_drug_columns)),
+    ('txt_to_columns', txt_to_columns,
+      (c.chembl_targets, "\t", chembl_target_columns)),
+    ('swap_dic', swap_dic, (c.chembl_uniprot, 'one')),
+    ('txt_to_dic', txt_to_dic, (c.chembl_input, "CHEMBL_ID",
+                                "CANONICAL_SMILES")),
+    ('csv_to_dic', csv_to_dic, (c.uniprot_pdb,)),
+    ('lst_dic', lst_dic, (c.pdb_lig,)),
+    ('csv_to_lst', csv_to_lst, (c.pointless_het,)),
+    ('smi_to_dic', smi_to_dic, (c.cc_smi, 1, 0)),
+    ('species_index', species_index, (c.spec_list,))]
+
+  manifest = {'python': sys.version_info[:2], 'format': bundle_format}
+
+  # the loaders must parse the text files, not read the old bundle
+  use_bundle = c.use_bundle
+  c.use_bundle = False
+  try:
+    for loader_name, loader, args in bundle_jobs:
+      source = args[0]
+      if not os.path.isfile(source):
+        logger.info('The file ' + source + ' is missing, we skip it.')
+        continue
+
+      entry, file_name = bundle_entry(loader_name, args)
+      returned = loader(*args)
+
+      with open(file_name, 'wb') as f:
+        f.write(marshal.dumps(returned, 2))
+
+      manifest[entry] = (source, file_stamp(source))
+      logger.info('We have compiled ' + source + ' (' + loader_name + ').')
+  finally:
+    c.use_bundle = use_bundle
+
+  with open(os.path.join(c.bundle_dir, 'manifest.p'), 'wb') as f:
+    pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+  bundle_manifest_cache.clear()
+############################################################################
+
+
+
+
+############################################################################
+### SPECIES_INDEX
+############################################################################
+# parse the species codes file (speclist.txt) once and return dictionary
+# {mnemonic code: (taxon id, kingdom, official name)}
+# eg {'SCHMA': ('6183', 'E', 'Schistosoma mansoni')}
+# the dictionary is pickled to c.species_index together with size and
+# modification time of the species file, and only rebuilt when that changes
+
+# regex for the first line of each species entry, eg
+# 'SCHMA E   6183: N=Schistosoma mansoni'
+species_line = re.compile(r'^(\w+)\s+([A-Z])\s+(\d+):\s+N=(.*)$')
+
+# index loaded in this run, {species file: (file stamp, index dictionary)}
+species_index_cache = {}
+
+def species_index(species_map):
+  # read from the compiled input bundle if it is up to date
+  bundled = bundle_load('species_index', (species_map,))
+  if bundled is not None:
+    return bundled
+
+  # size and modification time of the species file
+  file_stat = os.stat(species_map)
+  stamp = (species_map, file_stat.st_size, file_stat.st_mtime)
+
+  # already loaded in this run
+  if species_map in species_index_cache:
+    if species_index_cache[species_map][0] == stamp:
+      return species_index_cache[species_map][1]
+
+  index_dic = None
+
+  # check if pickled index exists and is up to date
+  if os.path.isfile(c.species_index):
+    with open(c.species_index, 'rb') as f:
+      pickled_stamp, pickled_dic = pickle.load(f)
+    if pickled_stamp == stamp:
+      index_dic = pickled_dic
+
+  # otherwise parse the species file, one pass
+  if index_dic is None:
+    index_dic = {}
+    input_handle = open_input(species_map)
+    for line in input_handle:
+      match = species_line.match(line.rstrip('\r\n'))
+      if match:
+        code, kingdom, taxon_id, name = match.groups()
+        # keep the first entry if a code is listed twice
+        if code not in index_dic:
+          index_dic[code] = (taxon_id, kingdom, name.strip())
+    input_handle.close()
+
+    with open(c.species_index, 'wb') as f:
+      pickle.dump((stamp, index_dic), f, pickle.HIGHEST_PROTOCOL)
+
+  species_index_cache[species_map] = (stamp, index_dic)
+
+  return index_dic
+############################################################################
+
+
+
+
+############################################################################
+### TAXA_TO_TAXON_IDS
+############################################################################
+# return list of NCBI taxon ids (as strings) from taxa mnemonic codes, to be
+# used when filtering uniprot entries by taxonomy; unknown codes are skipped
+
+def taxa_to_taxon_ids(taxa_list, species_map):
+  index_dic = species_index(species_map)
+
+  taxon_lst = []
+  for tax in taxa_list:
+    if tax in index_dic:
+      taxon_lst.append(index_dic[tax][0])
+
+  return taxon_lst
+############################################################################
+
+
+
+
 ############################################################################
 ### TAXA_TO_SPECIES
 ############################################################################
 # return list of species from taxa ids, to be used for logging purposes
 
 def taxa_to_species(taxa_list, species_map):
+  index_dic = species_index(species_map)
 
   species_lst = []
 
-  # string to be used in the loggers
-  # species = ''
-
-  # regex starts with 'N='
-  starts_n = re.compile('N=.*')  
-
   for tax in taxa_list:
-
-    bits_list = []
-    with open(species_map) as f:
-
-      for line in f:
-        #split
-        split_line = line.split(' ')
-        if split_line[0].strip(' ') == tax:
-          #print split_line
-          for i in range(1,len(split_line)):
-            #print split_line[i]
-            if starts_n.match(split_line[i]):
-              # print split_line[i]
-              match = i
-              for j in range(match,len(split_line)):
-                bits_list.append(split_line[j].rstrip('\n').lstrip('N='))
-              # print split_line[i]
-
-    species_string = " ".join(bits_list)
-    # print species_string
+    # empty string if the code is not in the species file
+    species_string = ''
+    if tax in index_dic:
+      species_string = index_dic[tax][2]
     species_lst.append(species_string)
 
 
@@ -2475,6 +4294,16 @@ def percent_identity(drug_targ_map):
     # 24, 21, 24, 25, 26, 13, 18, 19, 19, 4, 13, 18, 18, 23, 18, 
     # 18, 18, 12, 25, 17, 21, 25, 15, 21, 17, 21, 3, 10]}
 
+  # uniprot rows of all the targets and proteins, from uniprot or the local
+  # flat file, fetched at once
+  entry_list = []
+  for drug in drug_targ_map:
+    for targ in drug_targ_map[drug]:
+      entry_list.append(targ)
+      for arch in drug_targ_map[drug][targ]:
+        entry_list.extend(drug_targ_map[drug][targ][arch])
+  record_dic = uniprot_table(sorted(set(entry_list)))
+
   for drug in drug_targ_map:
   # for drug in ['CHEMBL98', 'CHEMBL973']:
     # logger.info(drug)
@@ -2489,19 +4318,15 @@ def percent_identity(drug_targ_map):
         # logger.info(targ)
 
         # write fasta drug target
-        try:
-          # get handle
-          handle = ExPASy.get_sprot_raw(targ)
-          # swissprot read
-          targ_record = SwissProt.read(handle)
+        targ_record = record_dic[targ]
+        # skip the targets that cannot be retrieved (see UNIPROT_FETCHER)
+        if targ_record is None:
+          logger.warning('The uniprot entry ' + targ + ' cannot be' +
+                         ' retrieved, it is left out of the scores')
+          continue
 
-          # sequence
-          targ_seq = targ_record.sequence
-          
-        except HTTPError:
-          logger.error('We cannot access ExPASy!')
-          logger.warning('We are exiting the program.')
-          sys.exit()
+        # sequence
+        targ_seq = targ_record.sequence
 
 
         # logger.info(targ_seq)
@@ -2522,20 +4347,15 @@ def percent_identity(drug_targ_map):
         # each schisto protein
         for prot in protein_list:
 
-          try:
-              # get handle
-              handle = ExPASy.get_sprot_raw(prot)
-              # swissprot read
-              record = SwissProt.read(handle)
-
-              # sequence
-              seq = record.sequence
-              
+          record = record_dic[prot]
+          # skip the proteins that cannot be retrieved
+          if record is None:
+            logger.warning('The uniprot entry ' + prot + ' cannot be' +
+                           ' retrieved, it is left out of the scores')
+            continue
 
-          except HTTPError:
-            logger.error('We cannot access ExPASy!')
-            logger.warning('We are exiting the program.')
-            sys.exit()
+          # sequence
+          seq = record.sequence
 
           # logger.info(seq)
           
@@ -2760,13 +4580,22 @@ def main():
     taxa_targets = run_or_pickle("1_human_targets", expasy_dic, 
                                     uniprot_list, "taxa")
 
+    # taxon id of human, from the species index
+    human_ids = taxa_to_taxon_ids(['HUMAN'], c.spec_list)
+    if not human_ids:
+      logger.error('The taxa code HUMAN cannot be found in ' +
+                   c.spec_list + '!')
+      logger.info('Please check config.py')
+      logger.warning('The program is aborted.')
+      sys.exit()
+    human_targets = taxa_targets.get(human_ids[0], [])
 
-    percent_human = round(float(len(taxa_targets['9606'])) / 
+    percent_human = round(float(len(human_targets)) / 
                           float(len(uniprot_list)) * 100)
     
 
 
-    logger.info('Of these targets, ' + str(len(taxa_targets['9606'])) + 
+    logger.info('Of these targets, ' + str(len(human_targets)) + 
                 ' are human proteins (the ' + str(percent_human) + ' %).')
 
     logger.info('----------------------------------------------------------')
@@ -2790,69 +4619,16 @@ def main():
                 'the targets\' Uniprot ids to CATH/Uniprot ids.')
 
 
-    if len(uniprot_list) < 1000:
-      cath_dic = run_or_pickle("2_cath_dic", uniprot_to_arch, uniprot_list, 
-                            "cath")
-      pfam_dic = run_or_pickle("2_pfam_dic", uniprot_to_arch, uniprot_list, 
-                              "pfam")
-
-
-    else:
-      # splitting chembl_het_map in chunks
-      uniprot1,uniprot2,uniprot3, uniprot4, uniprot5 = \
-                          zip(*izip_longest(*[iter(uniprot_list)]*5))
-
-      logger.info('We have split the uniprot list in chuncks of ' +
-                  str(len(uniprot1)) + ', ' + str(len(uniprot2)) + ', ' + 
-                  str(len(uniprot3)) + ', ' + str(len(uniprot4)) + ', ' +
-                  str(len(uniprot5)) )
-
-      # run or pickle uniprot_to_arch to retrieve cath domain architectures
-      cath_dic1 = run_or_pickle("2_cath_dic1", uniprot_to_arch, uniprot1, 
-                              "cath")
-
-      cath_dic2 = run_or_pickle("2_cath_dic2", uniprot_to_arch, uniprot2, 
-                              "cath")
-      cath_dic3 = run_or_pickle("2_cath3_dic3", uniprot_to_arch, uniprot3, 
-                              "cath")
-      cath_dic4 = run_or_pickle("2_cath3_dic4", uniprot_to_arch, uniprot4, 
-                              "cath")
-      cath_dic5 = run_or_pickle("2_cath3_dic5", uniprot_to_arch, uniprot5, 
-                              "cath")
-
-
-      cath_dic = dict(cath_dic1.items() + cath_dic2.items() + 
-                      cath_dic3.items() + cath_dic4.items() + 
-                      cath_dic5.items())
-
-
-      # run or pickle uniprot_to_arch to retrieve pfam domain architectures
-      pfam_dic1 = run_or_pickle("2_pfam_dic1", uniprot_to_arch, uniprot1, 
-                              "pfam")
-
-      pfam_dic2 = run_or_pickle("2_pfam_dic2", uniprot_to_arch, uniprot2, 
-                              "pfam")
-
-      pfam_dic3 = run_or_pickle("2_pfam_dic3", uniprot_to_arch, uniprot3, 
-                              "pfam")
-      pfam_dic4 = run_or_pickle("2_pfam_dic4", uniprot_to_arch, uniprot4, 
-                              "pfam")
-
-      pfam_dic5 = run_or_pickle("2_pfam_dic5", uniprot_to_arch, uniprot5, 
-                              "pfam")
-
-
-
-      pfam_dic = dict(pfam_dic1.items() + 
-                    pfam_dic2.items() + pfam_dic3.items() + 
-                    pfam_dic4.items() + pfam_dic5.items())
-
-
+    # archindex queries run in batches, c.archindex_workers at a time
+    # not pickled as a whole: each query is reused from the archindex cache
+    # (c.archindex_cache), so that new targets are still looked up
+    cath_dic = uniprot_to_arch(uniprot_list, "cath")
+    pfam_dic = uniprot_to_arch(uniprot_list, "pfam")
 
 
     #logger.info(cath_dic)
     # generate list, flatten it and rm duplicates
-    cath_list = run_or_pickle("2_cath_list", flatten_dic, cath_dic, "values")
+    cath_list = flatten_dic(cath_dic, "values")
 
 
 
@@ -2862,7 +4638,7 @@ def main():
 
 
     # generate list, flatten it and rm duplicates
-    pfam_list = run_or_pickle("2_pfam_list", flatten_dic, pfam_dic, "values")
+    pfam_list = flatten_dic(pfam_dic, "values")
 
 
     logger.info('We have mapped ' + str(len(pfam_dic)) + ' uniprot ids to ' +
@@ -2888,55 +4664,29 @@ def main():
                 'to UniProt ids of the species ' + species_string + '.')
     
    
-    if len(cath_list) < 1000:
-      # call archindex on cath values to find the ones from schisto
-      uniprot_schisto_cath_dic = run_or_pickle("3_uniprot_schisto_cath_dic", 
-                                            arch_to_uniprot, cath_list, 
-                                            "cath")
-
-    else:
-
-      # splitting cath_list in chunks
-      cath_list1, cath_list2, cath_list3 = \
-                        zip(*izip_longest(*[iter(cath_list)]*3))
-      # logger.info(len(cath_list2))
-
-      uniprot_schisto_cath_dic1 = run_or_pickle("3_uniprot_schisto_cath_dic1", 
-                                            arch_to_uniprot, cath_list1, 
-                                            "cath")
-      uniprot_schisto_cath_dic2 = run_or_pickle("3_uniprot_schisto_cath_dic2", 
-                                            arch_to_uniprot, cath_list2, 
-                                            "cath")
-      uniprot_schisto_cath_dic3 = run_or_pickle("3_uniprot_schisto_cath_dic3", 
-                                            arch_to_uniprot, cath_list3, 
-                                            "cath")
-
-      uniprot_schisto_cath_dic = dict(uniprot_schisto_cath_dic1.items() + 
-                  uniprot_schisto_cath_dic2.items() + 
-                  uniprot_schisto_cath_dic3.items())
+    # call archindex on cath values to find the ones from schisto
+    # (in batches, c.archindex_workers at a time, reused from the archindex
+    # cache as in step 2)
+    uniprot_schisto_cath_dic = arch_to_uniprot(cath_list, "cath")
 
 
     # generate list, flatten it and rm duplicates
-    uniprot_schisto_cath_list = run_or_pickle("3_uniprot_schisto_cath_list",
-                                flatten_dic, uniprot_schisto_cath_dic, 
-                                "values")
+    uniprot_schisto_cath_list = flatten_dic(uniprot_schisto_cath_dic,
+                                            "values")
 
     logger.info('We have mapped ' + str(len(uniprot_schisto_cath_dic)) + 
                 ' CATH ids to ' + str(len(uniprot_schisto_cath_list)) +
                 ' Uniprot ids.')
 
     # call archindex on pfam values to find ones from schisto
-    uniprot_schisto_pfam_dic = run_or_pickle("3_uniprot_schisto_pfam_dic", 
-                                            arch_to_uniprot, pfam_list, 
-                                            "pfam")
+    uniprot_schisto_pfam_dic = arch_to_uniprot(pfam_list, "pfam")
     #logger.debug(len(uniprot_schisto_pfam_dic))
 
 
 
     # generate list, flatten it and rm duplicates
-    uniprot_schisto_pfam_list = run_or_pickle("3_uniprot_schisto_pfam_list",
-                                flatten_dic, uniprot_schisto_pfam_dic, 
-                                "values")
+    uniprot_schisto_pfam_list = flatten_dic(uniprot_schisto_pfam_dic,
+                                            "values")
 
     # logger.info(uniprot_schisto_pfam_dic)
     logger.info('We have mapped ' + str(len(uniprot_schisto_pfam_dic)) + 
@@ -2945,9 +4695,8 @@ def main():
 
     # merge and rm duplicates
     # this is total list of unique schisto uniprot ids
-    uniprot_schisto_list = run_or_pickle("3_uniprot_schisto_list", 
-                          merge_lists, uniprot_schisto_cath_list, 
-                          uniprot_schisto_pfam_list)
+    uniprot_schisto_list = merge_lists(uniprot_schisto_cath_list,
+                                       uniprot_schisto_pfam_list)
     
     logger.info('In total, we have identified ' + 
                 str(len(uniprot_schisto_list)) + 
@@ -2990,13 +4739,21 @@ def main():
 
       # generate big map for chembl drugs
       # drug: target: arch: targ
-      chembl_repo_map = run_or_pickle("4_chembl_repo_map", chembl_repo, 
+      chembl_repo_map = run_or_pickle("4_chembl_repo_map", dataset_repo,
                                       chembl_dic, cath_dic,
                                       uniprot_schisto_cath_dic, pfam_dic, 
                                       uniprot_schisto_pfam_dic)
       # logger.debug(len(chembl_repo_map))
       # number of unique targets
-      chembl_repo_schisto_list = flatten_dic(chembl_repo_map, 'values_4')
+      if c.sparse_graph:
+        # from the sparse matrices, with the drug ranking
+        chembl_graph = DrugGraph(chembl_dic, cath_dic,
+                                 uniprot_schisto_cath_dic, pfam_dic,
+                                 uniprot_schisto_pfam_dic)
+        chembl_repo_schisto_list = chembl_graph.reached_proteins()
+        drug_ranking(c.dataset_dic['A'], chembl_graph)
+      else:
+        chembl_repo_schisto_list = flatten_dic(chembl_repo_map, 'values_4')
 
 
 
@@ -3025,12 +4782,21 @@ def main():
     if 'B' in c.sets:
 
       # generate big map for drugbank drugs
-      drugbank_repo_map = run_or_pickle("4_drugbank_repo_map", drugbank_repo, 
+      drugbank_repo_map = run_or_pickle("4_drugbank_repo_map", dataset_repo,
                                         drugbank_dic, cath_dic,
                                         uniprot_schisto_cath_dic, pfam_dic, 
                                         uniprot_schisto_pfam_dic)
       # number of unique targets
-      drugbank_repo_schisto_list = flatten_dic(drugbank_repo_map, 'values_4')
+      if c.sparse_graph:
+        # from the sparse matrices, with the drug ranking
+        drugbank_graph = DrugGraph(drugbank_dic, cath_dic,
+                                   uniprot_schisto_cath_dic, pfam_dic,
+                                   uniprot_schisto_pfam_dic)
+        drugbank_repo_schisto_list = drugbank_graph.reached_proteins()
+        drug_ranking(c.dataset_dic['B'], drugbank_graph)
+      else:
+        drugbank_repo_schisto_list = flatten_dic(drugbank_repo_map,
+                                                 'values_4')
   
 
       logger.info('We have built the ' + c.dataset_dic['B'] + 
@@ -3078,6 +4844,15 @@ def main():
                 'to the Het groups the contain, and then filter out ' +
                 'the Het groups contained in ' + c.pointless_het + 
                 ', a list of ions, metals, peptidic ligands, etc.')
+    # parse the reference files of steps 5 and 6 at the same time, ahead
+    # of their run_or_pickle calls, they do not depend on each other
+    ref_jobs = [("5_pdb_lig_dic", lst_dic, (c.pdb_lig,)),
+                ("5_pointless_het", csv_to_lst, (c.pointless_het,))]
+    if c.steps > step:
+      ref_jobs.extend([("6_uniprot_pdb_dic", csv_to_dic, (c.uniprot_pdb,)),
+                       ("6_cc_smiles", smi_to_dic, (c.cc_smi, 1, 0))])
+    parallel_load(ref_jobs)
+
     # make dictionary of pdb to ligands
     pdb_lig_dic = run_or_pickle("5_pdb_lig_dic", lst_dic, c.pdb_lig)
 
@@ -3086,7 +4861,7 @@ def main():
 
     # make list of ccs to ignore
     pointless_het = run_or_pickle("5_pointless_het", csv_to_lst,
-                                      c.pointless_het)
+                                  c.pointless_het)
     logger.info("The list of ligands we wish to ignore " +
                 "contains " + str(len(pointless_het)) + " ligands.")
 
@@ -3175,7 +4950,7 @@ def main():
                 ' drug targets that could be mapped to some schisto target.')
 
     # make dictionary uniprot to pdb
-    uniprot_pdb_dic = run_or_pickle("6_uniprot_pdb_dic", csv_to_dic, 
+    uniprot_pdb_dic = run_or_pickle("6_uniprot_pdb_dic", csv_to_dic,
                                     c.uniprot_pdb)
     #logger.debug(uniprot_pdb_dic)
 
@@ -3409,7 +5184,7 @@ def main():
       # (total 6799 drugs mapped to smiles)
       drugbank_id_smi_dic = run_or_pickle('7_drugbank_id_smi_dic', 
                                           sdf_to_dic, c.drugbank_sdf, 
-                                          'DATABASE_ID', 'SMILES')
+                                          'DATABASE_ID', 'SMILES', c.sdf_mmap)
       # logger.info(drugbank_id_smi_dic)
       
 
@@ -3837,7 +5612,12 @@ def main():
 ### MAIN FUNCION CALL
 ############################################################################
 # call main function, prevent excecution on import
+# 'python drug_repo.py compile-inputs' builds the input bundle instead
 
 if __name__ == "__main__":
-  main()
+  # compile-inputs mode, only build the input bundle
+  if len(sys.argv) > 1 and sys.argv[1] == 'compile-inputs':
+    compile_inputs()
+  else:
+    main()
 ############################################################################
\ No newline at end of file